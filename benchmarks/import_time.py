@@ -0,0 +1,57 @@
+"""
+Import time of the niskine package and its submodules.
+
+Each import is timed in a fresh interpreter. Run from the repository root:
+
+    python benchmarks/import_time.py
+"""
+
+import subprocess
+import sys
+
+MODULES = [
+    "niskine",
+    "niskine.io",
+    "niskine.merge",
+    "niskine.filters",
+    "niskine.spectra",
+    "niskine.era5",
+]
+
+
+def import_time(module, repeat=5):
+    """Best wall time [s] of importing a module in a new interpreter."""
+    code = (
+        "import time; t0 = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - t0)"
+    )
+    times = [
+        float(subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout)
+        for _ in range(repeat)
+    ]
+    return min(times)
+
+
+def heaviest_imports(module, n=10):
+    """Largest cumulative import times [us] from `python -X importtime`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+if __name__ == "__main__":
+    for module in MODULES:
+        print(f"{module:20s} {import_time(module) * 1e3:8.1f} ms")
+    print("\nheaviest imports of niskine.merge [us]:")
+    for cumulative, name in heaviest_imports("niskine.merge"):
+        print(f"{cumulative:10d}  {name}")
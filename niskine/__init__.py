@@ -1,5 +1,35 @@
 """Top-level package for NISKINe analysis"""
 
+import importlib
 
-__all__ = ["io", "merge"]
-from . import io, merge
+__all__ = [
+    "io",
+    "merge",
+    "era5",
+    "windwork",
+    "points",
+    "eke",
+    "eof",
+    "bathy",
+    "filters",
+    "spectra",
+    "modes",
+    "coverage",
+    "masks",
+    "cli",
+    "catalog",
+    "consistency",
+    "array",
+]
+
+
+def __getattr__(name):
+    # Submodules are imported on first access so that `import niskine` does
+    # not pull in xarray, scipy and friends until they are needed.
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,127 @@
+"""
+Merged ADCP data of all moorings on a shared time vector.
+"""
+
+import numpy as np
+import xarray as xr
+
+from . import io, merge
+
+
+def shared_time_vector(moorings=(1, 2, 3), dt_min=10) -> np.ndarray:
+    """Time vector spanning the deployment of all moorings.
+
+    Parameters
+    ----------
+    moorings : list of int, optional
+        Mooring numbers. Defaults to all three NISKINe moorings.
+    dt_min : int, optional
+        Period [minutes]. Defaults to 10min.
+
+    Returns
+    -------
+    np.ndarray
+        Time vector on the same grid as `merge.MergeADCP` time vectors.
+    """
+    spans = [io.mooring_start_end_time(mooring) for mooring in moorings]
+    start = min(span.start for span in spans)
+    stop = max(span.stop for span in spans)
+    return np.arange(start, stop, dt_min, dtype="datetime64[m]")
+
+
+def build_array_product(
+    moorings=(1, 2, 3),
+    suffix="simple_merge_gaps_filled",
+    dt_min=10,
+    outfile=None,
+    time_chunk=4320,
+    complevel=4,
+):
+    """Stack merged ADCP data of all moorings on (mooring, z, time).
+
+    Merged products saved with `merge.save_merged` are placed on a shared
+    time vector and the union of their depth levels, one mooring at a time,
+    and written to a netcdf file chunked along mooring and time. Use
+    `load_array` to open it lazily.
+
+    Parameters
+    ----------
+    moorings : list of int, optional
+        Mooring numbers. Defaults to all three NISKINe moorings.
+    suffix : str, optional
+        Suffix of the merged ADCP files. Defaults to
+        'simple_merge_gaps_filled'.
+    dt_min : int, optional
+        Period [minutes] of the shared time vector. Defaults to 10min.
+    outfile : str or pathlib.Path, optional
+        Output file. Defaults to data.gridded.array from the config file.
+    time_chunk : int, optional
+        Chunk size along time. Defaults to 4320 (30 days of 10min data).
+    complevel : int, optional
+        zlib compression level. Defaults to 4.
+    """
+    import netCDF4
+
+    if outfile is None:
+        outfile = io.load_config().data.gridded.array
+    files = [merge.gridded_file(mooring, suffix) for mooring in moorings]
+    time = shared_time_vector(moorings, dt_min).astype("datetime64[ns]")
+    tolerance = np.timedelta64(dt_min, "m") / 2
+    z, variables = [], None
+    for file in files:
+        with xr.open_dataset(file) as ds:
+            z.append(ds.z.data)
+            names = [v for v, da in ds.data_vars.items() if "adcp" not in da.dims]
+            if variables is not None:
+                names = [var for var in variables if var in names]
+            variables = names
+    z = np.unique(np.concatenate(z))
+
+    for i, (mooring, file) in enumerate(zip(moorings, files)):
+        with xr.open_dataset(file) as ds:
+            ds = ds[variables].reindex(z=z)
+            ds = ds.reindex(time=time, method="nearest", tolerance=tolerance)
+            ds = ds.load().expand_dims(mooring=[mooring])
+            lon, lat, depth = io.mooring_location(mooring)
+        ds["lon"] = ("mooring", [lon])
+        ds["lat"] = ("mooring", [lat])
+        ds["bottom_depth"] = ("mooring", [depth])
+        ds = ds.transpose("mooring", "z", "time")
+        if i == 0:
+            ds.attrs = dict(project="NISKINe", product=suffix)
+            encoding = {
+                var: dict(
+                    zlib=True,
+                    complevel=complevel,
+                    chunksizes=(1, z.size, min(time_chunk, time.size)),
+                )
+                for var in variables
+            }
+            ds.to_netcdf(outfile, unlimited_dims=["mooring"], encoding=encoding)
+        else:
+            with netCDF4.Dataset(outfile, "a") as nc:
+                nc["mooring"][i] = mooring
+                for var in ds.data_vars:
+                    nc[var][i] = ds[var].data[0]
+
+
+def load_array(file=None, chunks={}) -> xr.Dataset:
+    """Open the array product lazily.
+
+    Parameters
+    ----------
+    file : str or pathlib.Path, optional
+        Array product written by `build_array_product`. Defaults to
+        data.gridded.array from the config file.
+    chunks : dict or None, optional
+        Passed on to `xr.open_dataset`. Defaults to the chunks on disk as
+        dask arrays, so only the chunks needed for a computation are read.
+
+    Returns
+    -------
+    xr.Dataset
+        Merged ADCP data on (mooring, z, time).
+    """
+    if file is None:
+        file = io.load_config().data.gridded.array
+    return xr.open_dataset(file, chunks=chunks)
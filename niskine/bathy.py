@@ -0,0 +1,228 @@
+"""
+Bathymetry.
+"""
+
+import functools
+import json
+from pathlib import Path
+import numpy as np
+import xarray as xr
+
+from . import io
+
+
+def build_mb_pyramid(factors=(2, 4, 8, 16, 32), outfile=None, complevel=4):
+    """Precompute coarsened versions of the multibeam bathymetry.
+
+    Each level is stored as a group in one chunked and compressed netcdf
+    file. Level 1 is the full resolution grid, every other level is a
+    block mean of the previous one. Use `load_mb` to read from the pyramid.
+
+    Parameters
+    ----------
+    factors : list of int, optional
+        Coarsening factors relative to the full resolution grid. Each factor
+        must be a multiple of the previous one. Defaults to (2, 4, 8, 16,
+        32).
+    outfile : str or pathlib.Path, optional
+        Output file. Defaults to data.proc.mb_pyramid from the config file.
+    complevel : int, optional
+        zlib compression level. Defaults to 4.
+    """
+    conf = io.load_config()
+    if outfile is None:
+        outfile = conf.data.proc.mb_pyramid
+    mb = xr.open_dataarray(conf.data.proc.mb).load()
+    name = mb.name if mb.name is not None else "z"
+    mb = mb.rename(name)
+
+    factors = [1] + list(factors)
+    spacing = []
+    level = mb
+    for i, factor in enumerate(factors):
+        if i > 0:
+            step = factor // factors[i - 1]
+            level = level.coarsen(lon=step, lat=step, boundary="pad").mean()
+        spacing.append(max(_spacing(level.lon), _spacing(level.lat)))
+        ds = level.to_dataset()
+        ds.attrs = dict(factor=factor)
+        chunks = [min(256, ds.sizes[dim]) for dim in level.dims]
+        encoding = {name: dict(zlib=True, complevel=complevel, chunksizes=chunks)}
+        ds.to_netcdf(
+            outfile,
+            group=f"level{factor}",
+            mode="w" if i == 0 else "a",
+            encoding=encoding,
+        )
+    root = xr.Dataset(attrs=dict(factors=factors, spacing=spacing, variable=name))
+    root.to_netcdf(outfile, mode="a")
+
+
+def load_mb(resolution=None, bbox=None, pyramid=None) -> xr.DataArray:
+    """Load multibeam bathymetry from the resolution pyramid.
+
+    Parameters
+    ----------
+    resolution : float, optional
+        Requested grid spacing [deg]. The coarsest level with a spacing
+        smaller than or equal to this is returned. Defaults to the full
+        resolution.
+    bbox : tuple, optional
+        Bounding box (lon_min, lon_max, lat_min, lat_max). Only data within
+        the box are read. Defaults to the whole grid.
+    pyramid : str or pathlib.Path, optional
+        Pyramid file generated by `build_mb_pyramid`. Defaults to
+        data.proc.mb_pyramid from the config file.
+
+    Returns
+    -------
+    xr.DataArray
+        Bathymetry.
+    """
+    if pyramid is None:
+        pyramid = io.load_config().data.proc.mb_pyramid
+    with xr.open_dataset(pyramid) as root:
+        factors = np.atleast_1d(root.attrs["factors"])
+        spacing = np.atleast_1d(root.attrs["spacing"])
+        name = root.attrs["variable"]
+    factor = factors[0]
+    if resolution is not None:
+        factor = factors[spacing <= resolution].max(initial=factor)
+    mb = xr.open_dataset(pyramid, group=f"level{factor}")[name]
+    if bbox is not None:
+        mb = mb.sel(
+            lon=_slice(mb.lon, bbox[0], bbox[1]),
+            lat=_slice(mb.lat, bbox[2], bbox[3]),
+        )
+    return mb
+
+
+def build_bathymetry_index(ss_bbox=(-33, -16, 53, 64), outdir=None):
+    """Write bathymetry grids to memory-mappable files for fast lookups.
+
+    The multibeam grid and Smith & Sandwell bathymetry are stored as raw
+    float32 arrays together with their grid definition. Both are saved as
+    elevation, i.e. negative below sea level. See `bathymetry` for queries.
+
+    Parameters
+    ----------
+    ss_bbox : tuple, optional
+        Bounding box (lon_min, lon_max, lat_min, lat_max) for the Smith &
+        Sandwell bathymetry. Defaults to the wider NISKINe region.
+    outdir : str or pathlib.Path, optional
+        Output directory. Defaults to data.proc.bathy_index from the config
+        file.
+    """
+    import gvpy as gv
+
+    conf = io.load_config()
+    if outdir is None:
+        outdir = conf.data.proc.bathy_index
+    outdir = Path(outdir)
+    outdir.mkdir(exist_ok=True, parents=True)
+
+    mb = xr.open_dataarray(conf.data.proc.mb).load()
+    # Convert depth to elevation; the region is predominantly ocean.
+    if mb.median() > 0:
+        mb = -mb
+    ss = gv.ocean.smith_sandwell(lon=list(ss_bbox[:2]), lat=list(ss_bbox[2:]))
+    for name, grid in dict(multibeam=mb, smith_sandwell=ss).items():
+        grid = grid.transpose("lat", "lon")
+        np.save(outdir.joinpath(f"{name}.npy"), grid.data.astype(np.float32))
+        meta = dict(
+            lon0=float(grid.lon[0]),
+            dlon=float(grid.lon[1] - grid.lon[0]),
+            nlon=grid.lon.size,
+            lat0=float(grid.lat[0]),
+            dlat=float(grid.lat[1] - grid.lat[0]),
+            nlat=grid.lat.size,
+        )
+        with open(outdir.joinpath(f"{name}.json"), "w") as file:
+            json.dump(meta, file)
+    _bathymetry_grids.cache_clear()
+
+
+def bathymetry(lon, lat, index_dir=None, block=1_000_000):
+    """Bathymetry at arbitrary points.
+
+    Bilinearly interpolates the multibeam grid and falls back to Smith &
+    Sandwell bathymetry for points outside of the multibeam coverage. Grids
+    are memory-mapped from the files written by `build_bathymetry_index`
+    and stay open between calls, so only the grid cells needed are read.
+
+    Parameters
+    ----------
+    lon, lat : array-like
+        Point coordinates, for example a ship or drifter track.
+    index_dir : str or pathlib.Path, optional
+        Directory with bathymetry index files. Defaults to
+        data.proc.bathy_index from the config file.
+    block : int, optional
+        Number of points processed at once. Defaults to one million.
+
+    Returns
+    -------
+    np.ndarray
+        Elevation [m], negative below sea level, with the shape of the input
+        coordinates. NaN where neither grid has data.
+    """
+    if index_dir is None:
+        index_dir = io.load_config().data.proc.bathy_index
+    grids = _bathymetry_grids(str(index_dir))
+    lon, lat = np.broadcast_arrays(np.asarray(lon, float), np.asarray(lat, float))
+    shape = lon.shape
+    lon = lon.ravel()
+    lat = lat.ravel()
+    out = np.full(lon.size, np.nan)
+    for i in range(0, lon.size, block):
+        sl = slice(i, i + block)
+        z = _grid_lookup(*grids["multibeam"], lon[sl], lat[sl])
+        missing = np.isnan(z)
+        if missing.any():
+            z[missing] = _grid_lookup(
+                *grids["smith_sandwell"], lon[sl][missing], lat[sl][missing]
+            )
+        out[sl] = z
+    return out.reshape(shape)
+
+
+@functools.lru_cache
+def _bathymetry_grids(index_dir):
+    grids = {}
+    for name in ["multibeam", "smith_sandwell"]:
+        with open(f"{index_dir}/{name}.json") as file:
+            meta = json.load(file)
+        grids[name] = np.load(f"{index_dir}/{name}.npy", mmap_mode="r"), meta
+    return grids
+
+
+def _grid_lookup(grid, meta, lon, lat):
+    x = (lon - meta["lon0"]) / meta["dlon"]
+    y = (lat - meta["lat0"]) / meta["dlat"]
+    nx, ny = meta["nlon"], meta["nlat"]
+    z = np.full(lon.size, np.nan)
+    inside = (x >= 0) & (x <= nx - 1) & (y >= 0) & (y <= ny - 1)
+    x = x[inside]
+    y = y[inside]
+    i = np.minimum(np.floor(x).astype(int), nx - 2)
+    j = np.minimum(np.floor(y).astype(int), ny - 2)
+    fx = x - i
+    fy = y - j
+    z[inside] = (
+        grid[j, i] * (1 - fx) * (1 - fy)
+        + grid[j, i + 1] * fx * (1 - fy)
+        + grid[j + 1, i] * (1 - fx) * fy
+        + grid[j + 1, i + 1] * fx * fy
+    )
+    return z
+
+
+def _spacing(coord):
+    return float(np.abs(np.median(np.diff(coord.data))))
+
+
+def _slice(coord, vmin, vmax):
+    """Slice in the direction of the coordinate."""
+    if coord[-1] < coord[0]:
+        return slice(vmax, vmin)
+    return slice(vmin, vmax)
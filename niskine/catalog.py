@@ -0,0 +1,203 @@
+"""
+Catalog of NISKINe data products.
+"""
+
+import re
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from . import io
+
+_COLUMNS = dict(
+    path="TEXT PRIMARY KEY",
+    kind="TEXT",
+    mooring="INTEGER",
+    sn="INTEGER",
+    variables="TEXT",
+    time_start="TEXT",
+    time_end="TEXT",
+    dt_seconds="REAL",
+    zmin="REAL",
+    zmax="REAL",
+    size="INTEGER",
+    mtime_ns="INTEGER",
+)
+
+
+class Catalog:
+
+    """Persistent SQLite catalog of all data products."""
+
+    def __init__(self, dbfile=None):
+        """Open the catalog.
+
+        The catalog holds path, mooring, serial number, variables, time and
+        depth extent and sampling period of every processed ADCP file,
+        merged ADCP product, the array product, SSH and wind file. Call
+        `refresh()` to bring it up to date; only new or modified files are
+        opened. Queries with `find()` do not open any netcdf files.
+
+        Parameters
+        ----------
+        dbfile : str or pathlib.Path, optional
+            SQLite database. Defaults to data.catalog from the config file.
+        """
+        self.conf = io.load_config()
+        self.dbfile = self.conf.data.catalog if dbfile is None else Path(dbfile)
+        self.dbfile.parent.mkdir(exist_ok=True, parents=True)
+        self.db = sqlite3.connect(self.dbfile)
+        columns = ", ".join(f"{k} {v}" for k, v in _COLUMNS.items())
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS products ({columns})")
+
+    def products(self) -> dict:
+        """All product files on disk by kind."""
+        data = self.conf.data
+        files = dict(
+            adcp=sorted(data.proc.adcp.glob("M*.nc")),
+            gridded_adcp=sorted(data.gridded.adcp.glob("M*.nc")),
+            array=[data.gridded.array],
+            ssh=sorted(data.ssh.glob("*.nc")),
+            wind=[data.wind.era5],
+        )
+        return {kind: [f for f in fi if f.exists()] for kind, fi in files.items()}
+
+    def refresh(self):
+        """Scan new and modified files and drop removed files.
+
+        Returns
+        -------
+        list of str
+            Paths of the files that were scanned.
+        """
+        known = {
+            path: (size, mtime)
+            for path, size, mtime in self.db.execute(
+                "SELECT path, size, mtime_ns FROM products"
+            )
+        }
+        scanned = []
+        present = set()
+        for kind, files in self.products().items():
+            for file in files:
+                path = str(file.resolve())
+                present.add(path)
+                stat = file.stat()
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                row = scan_file(file)
+                row.update(path=path, kind=kind)
+                row.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                self._upsert(row)
+                scanned.append(path)
+        removed = [(path,) for path in known if path not in present]
+        self.db.executemany("DELETE FROM products WHERE path = ?", removed)
+        self.db.commit()
+        return scanned
+
+    def find(
+        self, kind=None, mooring=None, sn=None, start=None, stop=None, z=None
+    ) -> pd.DataFrame:
+        """Find products.
+
+        Parameters
+        ----------
+        kind : {'adcp', 'gridded_adcp', 'array', 'ssh', 'wind'}, optional
+            Product type.
+        mooring : int, optional
+            Mooring number.
+        sn : int, optional
+            Instrument serial number.
+        start, stop : str or np.datetime64, optional
+            Only products covering this whole time range.
+        z : tuple, optional
+            Only products with data between these depths (zmin, zmax).
+
+        Returns
+        -------
+        pd.DataFrame
+            Matching products, one per row.
+        """
+        conditions, values = [], []
+        for column, value in dict(kind=kind, mooring=mooring, sn=sn).items():
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                values.append(value)
+        if start is not None:
+            conditions.append("time_start <= ?")
+            values.append(_time_string(start))
+        if stop is not None:
+            conditions.append("time_end >= ?")
+            values.append(_time_string(stop))
+        if z is not None:
+            conditions += ["zmax >= ?", "zmin <= ?"]
+            values += [float(min(z)), float(max(z))]
+        query = "SELECT * FROM products"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        out = pd.read_sql_query(query + " ORDER BY path", self.db, params=values)
+        for column in ["time_start", "time_end"]:
+            out[column] = pd.to_datetime(out[column])
+        return out
+
+    def close(self):
+        self.db.close()
+
+    def _upsert(self, row):
+        columns = list(_COLUMNS)
+        placeholders = ", ".join("?" for _ in columns)
+        self.db.execute(
+            f"INSERT OR REPLACE INTO products ({', '.join(columns)}) "
+            f"VALUES ({placeholders})",
+            [row.get(column) for column in columns],
+        )
+
+
+def scan_file(file) -> dict:
+    """Metadata of a netcdf file.
+
+    Only coordinates are read.
+
+    Parameters
+    ----------
+    file : pathlib.Path
+        netcdf file.
+
+    Returns
+    -------
+    dict
+        Mooring, serial number, variables, time and depth extent and median
+        sampling period.
+    """
+    row = {}
+    match = re.match(r"M(\d+)_(\d+)?", file.name)
+    if match is not None:
+        row["mooring"] = int(match.group(1))
+        if match.group(2) is not None and "gridded" not in file.name:
+            row["sn"] = int(match.group(2))
+    with xr.open_dataset(file) as ds:
+        row["variables"] = ",".join(sorted(map(str, ds.data_vars)))
+        if "time" in ds.coords and ds.time.size > 0:
+            time = ds.time.data
+            row["time_start"] = _time_string(time.min())
+            row["time_end"] = _time_string(time.max())
+            if time.size > 1:
+                dt = np.median(np.diff(time)) / np.timedelta64(1, "s")
+                row["dt_seconds"] = float(dt)
+        for name in ["z", "depth"]:
+            if name in ds.coords and ds[name].size > 0:
+                row["zmin"] = float(ds[name].min())
+                row["zmax"] = float(ds[name].max())
+                break
+        if "sn" in ds.attrs and "sn" not in row:
+            try:
+                row["sn"] = int(ds.attrs["sn"])
+            except (TypeError, ValueError):
+                pass
+    return row
+
+
+def _time_string(time):
+    return np.datetime_as_string(np.datetime64(time, "s"), unit="s")
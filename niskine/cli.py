@@ -0,0 +1,306 @@
+"""
+Command line interface.
+"""
+
+import argparse
+import concurrent.futures
+import sys
+
+import yaml
+
+from . import io
+
+# Rough peak memory use of a merge job in multiples of the size of its input
+# files (interpolated copies, merged product and coverage index).
+MEMORY_FACTOR = 6
+
+
+def main(argv=None):
+    """Entry point of the `niskine` command."""
+    parser = argparse.ArgumentParser(prog="niskine", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    merge = commands.add_parser("merge", help="run merge jobs from a yaml file")
+    merge.add_argument("jobfile", help="yaml file with a list of merge jobs")
+    merge.add_argument(
+        "-j", "--workers", type=int, default=None, help="number of processes"
+    )
+    merge.add_argument(
+        "-m",
+        "--memory",
+        type=float,
+        default=None,
+        help="memory budget [GB], defaults to 75%% of available memory",
+    )
+    merge.add_argument(
+        "-f", "--force", action="store_true", help="run jobs with unchanged inputs"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "merge":
+        jobs = load_merge_jobs(args.jobfile)
+        memory = None if args.memory is None else args.memory * 1e9
+        failed = run_merge_jobs(
+            jobs, workers=args.workers, memory=memory, force=args.force
+        )
+        return 1 if failed else 0
+
+
+def load_merge_jobs(jobfile) -> list[dict]:
+    """Read merge jobs from a yaml file.
+
+    The file contains a list of jobs. Each job needs a `mooring` and an
+    optional `suffix` for the output file. `fill_gaps: true` saves the gap
+    filled product and `packing` is passed on to `merge.save_merged`. All
+    other keys are passed on to `merge.MergeADCP`, for example
+
+        - mooring: 1
+          suffix: simple_merge_gaps_filled
+          method: simple
+          fill_gaps: true
+
+    Jobs of the same mooring that only differ in these output options share
+    a single merge.
+
+    Parameters
+    ----------
+    jobfile : str or pathlib.Path
+        Job file.
+
+    Returns
+    -------
+    list of dict
+        Merge jobs.
+    """
+    with open(jobfile) as file:
+        jobs = yaml.safe_load(file)
+    for job in jobs:
+        if "mooring" not in job:
+            raise ValueError(f"merge job without mooring: {job}")
+    return jobs
+
+
+def run_merge_jobs(jobs, workers=None, memory=None, force=False) -> dict:
+    """Run merge jobs in parallel processes.
+
+    All jobs of a mooring run in the same process, one after the other, as
+    they share input files and cached intermediate products. Moorings are
+    started as long as their estimated memory use fits into the memory
+    budget, but at least one mooring is always running. Jobs whose input
+    files and parameters have not changed since their output was written
+    are skipped. A report on the consistency of overlapping ADCPs is
+    written next to each product.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        Merge jobs, see `load_merge_jobs`.
+    workers : int, optional
+        Maximum number of processes. Defaults to the number of cores.
+    memory : float, optional
+        Memory budget [bytes]. Defaults to 75% of the available memory.
+    force : bool, optional
+        Also run jobs with unchanged inputs. Defaults to False.
+
+    Returns
+    -------
+    dict
+        Error messages of failed jobs, keyed by output file name.
+    """
+    from . import merge
+
+    manifest_file = io.load_config().data.cache.joinpath("merge_jobs.json")
+    manifest = io.read_json(manifest_file)
+    if memory is None:
+        memory = 0.75 * _available_memory()
+
+    by_mooring = {}
+    fingerprints = {}
+    for job in jobs:
+        outfile = merge.gridded_file(job["mooring"], job.get("suffix"))
+        name = outfile.name
+        fingerprint = job_fingerprint(job)
+        unchanged = manifest.get(name) == fingerprint and outfile.exists()
+        if unchanged and not force:
+            print(f"{name}: inputs unchanged, skipping")
+            continue
+        by_mooring.setdefault(job["mooring"], []).append(job)
+        fingerprints[name] = fingerprint
+    # Jobs of a mooring run one after the other and need as much memory as
+    # the largest of them. Large moorings first so that small ones can fill
+    # up the remaining budget.
+    pending = [
+        (mjobs, max(job_memory(job) for job in mjobs))
+        for mjobs in by_mooring.values()
+    ]
+    pending.sort(key=lambda item: item[1], reverse=True)
+
+    failed = {}
+    running = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            in_use = sum(item[1] for item in running.values())
+            for item in list(pending):
+                if running and in_use + item[1] > memory:
+                    continue
+                print(f"M{item[0][0]['mooring']}: starting {len(item[0])} job(s)")
+                running[executor.submit(run_mooring_jobs, item[0])] = item
+                pending.remove(item)
+                in_use += item[1]
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                mjobs, _ = running.pop(future)
+                try:
+                    errors = future.result()
+                except Exception as e:
+                    errors = {_output_name(job): repr(e) for job in mjobs}
+                for name, error in errors.items():
+                    if error is not None:
+                        print(f"{name}: failed with {error}")
+                        failed[name] = error
+                        continue
+                    print(f"{name}: done")
+                    manifest[name] = fingerprints[name]
+                io.write_json(manifest_file, manifest, indent=2)
+    return failed
+
+
+def run_mooring_jobs(jobs) -> dict:
+    """Run the merge jobs of one mooring.
+
+    Jobs with the same merge parameters are run from a single
+    `merge.MergeADCP`, for example the plain and the gap filled product.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        Merge jobs of one mooring, see `load_merge_jobs`.
+
+    Returns
+    -------
+    dict
+        Error message or None for each job, keyed by output file name.
+    """
+    groups = {}
+    for job in jobs:
+        key = repr(sorted(_merge_kwargs(job).items()))
+        groups.setdefault(key, []).append(job)
+    errors = {}
+    for group in groups.values():
+        try:
+            ma = merge_adcps(group[0])
+        except Exception as e:
+            errors.update({_output_name(job): repr(e) for job in group})
+            continue
+        for job in group:
+            try:
+                save_outputs(ma, job)
+            except Exception as e:
+                errors[_output_name(job)] = repr(e)
+            else:
+                errors[_output_name(job)] = None
+    return errors
+
+
+def run_merge_job(job):
+    """Merge ADCPs and save the result and a consistency report.
+
+    Parameters
+    ----------
+    job : dict
+        Merge job, see `load_merge_jobs`.
+
+    Returns
+    -------
+    pathlib.Path
+        Output file.
+    """
+    return save_outputs(merge_adcps(job), job)
+
+
+def merge_adcps(job):
+    """`merge.MergeADCP` with the merge parameters of a job."""
+    from . import merge
+
+    ma = merge.MergeADCP(**_merge_kwargs(job))
+    ma.compare_adcps()
+    return ma
+
+
+def save_outputs(ma, job):
+    """Save the merged product of a job and its consistency report.
+
+    Parameters
+    ----------
+    ma : merge.MergeADCP
+        Merged ADCPs, see `merge_adcps`.
+    job : dict
+        Merge job, see `load_merge_jobs`.
+
+    Returns
+    -------
+    pathlib.Path
+        Output file.
+    """
+    from . import merge
+
+    suffix = job.get("suffix")
+    merged = ma.merged
+    if job.get("fill_gaps", False):
+        if not hasattr(ma, "mergedf"):
+            ma.fill_gaps()
+        merged = ma.mergedf
+    merge.save_merged(merged, suffix=suffix, packing=job.get("packing"))
+    merge.save_consistency_report(ma.consistency, job["mooring"], suffix)
+    return merge.gridded_file(job["mooring"], suffix)
+
+
+def job_fingerprint(job) -> str:
+    """Hash of the job parameters and the state of its input files."""
+    conf = io.load_config()
+    files = sorted(conf.data.proc.adcp.glob(f"M{job['mooring']}*.nc"))
+    files.append(conf.mooring_locations)
+    return io.fingerprint(sorted(job.items(), key=lambda item: item[0]), *files)
+
+
+def job_memory(job) -> float:
+    """Estimated peak memory use [bytes] of a merge job."""
+    conf = io.load_config()
+    files = conf.data.proc.adcp.glob(f"M{job['mooring']}*.nc")
+    size = sum(file.stat().st_size for file in files) * MEMORY_FACTOR
+    if job.get("precision") == "float32":
+        size = size / 2
+    return size
+
+
+def _merge_kwargs(job):
+    """Parameters of a job that are passed on to `merge.MergeADCP`."""
+    outputs = ["suffix", "fill_gaps", "packing"]
+    return {key: value for key, value in job.items() if key not in outputs}
+
+
+def _output_name(job):
+    """File name of the merged product of a job."""
+    from . import merge
+
+    return merge.gridded_file(job["mooring"], job.get("suffix")).name
+
+
+def _available_memory():
+    """MemAvailable from /proc/meminfo [bytes].
+
+    Unlike free memory this includes page cache that can be reclaimed.
+    """
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return float("inf")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
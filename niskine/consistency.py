@@ -0,0 +1,98 @@
+"""
+Consistency of overlapping ADCP measurements.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def consistency_metrics(adcps_interp, variables=("u", "v"), time_block=4096):
+    """Bias, RMS difference and correlation between overlapping ADCPs.
+
+    For each variable, sums over the overlap cells of every pair of ADCPs
+    are accumulated as matrix products of the data and validity masks of
+    all ADCPs, one block of time at a time. All metrics follow from these
+    sums.
+
+    Parameters
+    ----------
+    adcps_interp : list of xr.Dataset
+        ADCP data interpolated to a common time vector and a common set of
+        depth levels (each ADCP may cover a subset of the levels), for
+        example `MergeADCP.adcps_sorted_ti_zi`.
+    variables : list of str, optional
+        Variables to compare. Defaults to u and v.
+    time_block : int, optional
+        Number of time steps processed at once. Defaults to 4096.
+
+    Returns
+    -------
+    xr.Dataset
+        For each variable and pair of ADCPs (adcp, adcp2): number of
+        overlapping cells (n), mean difference adcp - adcp2 (bias), RMS
+        difference (rms) and correlation (corr).
+    """
+    z = np.unique(np.concatenate([ai.z.data for ai in adcps_interp]))
+    rows = [np.searchsorted(z, ai.z.data) for ai in adcps_interp]
+    nt = adcps_interp[0].time.size
+    n = len(adcps_interp)
+
+    sns = [ai.attrs.get("sn", i) for i, ai in enumerate(adcps_interp)]
+    out = xr.Dataset(coords=dict(adcp=sns, adcp2=sns))
+    for var in variables:
+        count = np.zeros((n, n))
+        s = np.zeros((n, n))
+        q = np.zeros((n, n))
+        p = np.zeros((n, n))
+        data = [ai[var].transpose("z", "time").data for ai in adcps_interp]
+        for i in range(0, nt, time_block):
+            block = slice(i, i + time_block)
+            nb = min(nt, i + time_block) - i
+            x = np.full((n, z.size, nb), np.nan)
+            for k in range(n):
+                x[k, rows[k]] = data[k][:, block]
+            m = np.isfinite(x).astype(float).reshape(n, -1)
+            x = np.nan_to_num(x).reshape(n, -1)
+            count += m @ m.T
+            # Sums of x_i and x_i^2 over the overlap with j, and of x_i x_j.
+            s += x @ m.T
+            q += (x**2) @ m.T
+            p += x @ x.T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bias = (s - s.T) / count
+            rms = np.sqrt(np.clip(q + q.T - 2 * p, 0, None) / count)
+            corr = (count * p - s * s.T) / np.sqrt(
+                (count * q - s**2) * (count * q.T - s.T**2)
+            )
+        dims = ("adcp", "adcp2")
+        out[f"n_{var}"] = (dims, count.astype(np.int64))
+        out[f"bias_{var}"] = (dims, bias)
+        out[f"rms_{var}"] = (dims, rms)
+        out[f"corr_{var}"] = (dims, corr)
+    return out
+
+
+def consistency_report(metrics) -> pd.DataFrame:
+    """Table of metrics with one row per overlapping pair of ADCPs.
+
+    Parameters
+    ----------
+    metrics : xr.Dataset
+        Metrics as returned by `consistency_metrics`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Metrics for each pair (adcp, adcp2) with adcp shallower than adcp2
+        in the order of the merge.
+    """
+    n = metrics.adcp.size
+    i, j = np.triu_indices(n, 1)
+    table = pd.DataFrame(
+        dict(adcp=metrics.adcp.data[i], adcp2=metrics.adcp2.data[j])
+    )
+    for var in metrics.data_vars:
+        table[var] = metrics[var].data[i, j]
+    first = [var for var in metrics.data_vars if var.startswith("n_")][0]
+    return table[table[first] > 0].reset_index(drop=True)
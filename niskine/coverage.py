@@ -0,0 +1,283 @@
+"""
+Data coverage of individual ADCPs.
+"""
+
+import contextlib
+import warnings
+import numpy as np
+import xarray as xr
+import gsw
+
+from . import io, masks
+
+
+def coverage_index(adcp, lon=None, lat=None, cache=True) -> xr.Dataset:
+    """Compact per-profile and per-bin data coverage of an ADCP.
+
+    Calculated in one pass over the velocity and percent good data. Results
+    for ADCPs read from file are cached under data.cache, keyed by the
+    source file's size and modification time and the time range. Cache
+    files are written atomically; a cache file that cannot be read is
+    recomputed.
+
+    Parameters
+    ----------
+    adcp : xr.Dataset
+        Processed ADCP data with u on (z, time) and optionally pg and
+        pressure.
+    lon, lat : float, optional
+        Mooring location. Required for day/night flags and transducer depth.
+    cache : bool, optional
+        Read from and write to the cache. Defaults to True.
+
+    Returns
+    -------
+    xr.Dataset
+        Per profile: number of valid bins (nvalid), shallowest and deepest
+        valid depth (zmin, zmax), maximum valid range from the transducer
+        (range), mean percent good (pg) and a daytime flag (daytime). Per
+        bin: number of valid profiles (bin_count).
+    """
+    cfile = _cache_file(adcp, lon, lat) if cache else None
+    cached = io.read_cache(cfile)
+    if cached is not None:
+        return cached
+
+    valid = adcp.u.notnull().transpose("z", "time").data
+    z = adcp.z.data
+    zv = np.where(valid, z[:, np.newaxis], np.nan)
+    out = xr.Dataset(coords=dict(time=adcp.time, z=adcp.z))
+    out["nvalid"] = ("time", valid.sum(axis=0).astype(np.int16))
+    with _ignore_all_nan():
+        out["zmin"] = ("time", np.nanmin(zv, axis=0).astype(np.float32))
+        out["zmax"] = ("time", np.nanmax(zv, axis=0).astype(np.float32))
+        if "pg" in adcp:
+            pg = adcp.pg.transpose("z", "time").data
+            pg = np.where(valid, pg, np.nan)
+            out["pg"] = ("time", np.nanmean(pg, axis=0).astype(np.float32))
+    out["bin_count"] = ("z", valid.sum(axis=1).astype(np.int32))
+
+    if lat is not None and "pressure" in adcp:
+        xducer = -gsw.z_from_p(adcp.pressure.data, lat)
+        with _ignore_all_nan():
+            maxdist = np.nanmax(np.abs(zv - xducer), axis=0)
+        out["range"] = ("time", maxdist.astype(np.float32))
+    if lon is not None and lat is not None:
+        elevation = solar_elevation(adcp.time.data, lon, lat)
+        out["daytime"] = ("time", elevation > 0)
+
+    out.attrs = dict(sn=adcp.attrs.get("sn", ""))
+    if cfile is not None:
+        io.write_cache(out, cfile)
+    return out
+
+
+def valid_z_range(index):
+    """Indices of the first and last depth bin that ever have data.
+
+    Parameters
+    ----------
+    index : xr.Dataset
+        Coverage index as returned by `coverage_index`.
+
+    Returns
+    -------
+    slice or None
+        Slice along z, None if the ADCP has no data at all.
+    """
+    bins = np.flatnonzero(index.bin_count.data > 0)
+    if bins.size == 0:
+        return None
+    return slice(bins[0], bins[-1] + 1)
+
+
+def valid_z_extent(index):
+    """Shallowest and deepest depth with data.
+
+    Parameters
+    ----------
+    index : xr.Dataset
+        Coverage index as returned by `coverage_index`.
+
+    Returns
+    -------
+    tuple
+        (zmin, zmax), NaN if the ADCP has no data at all.
+    """
+    z = index.z.data[index.bin_count.data > 0]
+    if z.size == 0:
+        return np.nan, np.nan
+    return z.min(), z.max()
+
+
+def day_night_summary(index, freq="1MS") -> xr.Dataset:
+    """Day and night coverage statistics.
+
+    Parameters
+    ----------
+    index : xr.Dataset
+        Coverage index with daytime flags as returned by `coverage_index`.
+    freq : str, optional
+        Averaging period. Defaults to monthly.
+
+    Returns
+    -------
+    xr.Dataset
+        Mean number of valid bins, range and percent good for day and night
+        time profiles.
+    """
+    stats = index.drop_dims("z").drop_vars("daytime").astype(float)
+    day = stats.where(index.daytime).resample(time=freq).mean()
+    night = stats.where(~index.daytime).resample(time=freq).mean()
+    period = xr.DataArray(["day", "night"], dims="period")
+    return xr.concat([day, night], dim=period)
+
+
+def overlap_statistics(adcps, znew=None, tnew=None) -> xr.Dataset:
+    """Overlap of ADCP data on a common grid.
+
+    The validity of each ADCP's data on the grid is stored as a bit-packed
+    mask and all statistics are reduced from these masks. ADCPs that have
+    not been interpolated yet are mapped to the grid with the validity that
+    interpolation in time and depth would result in, see
+    `masks.validity_on_grid`.
+
+    Parameters
+    ----------
+    adcps : list of xr.Dataset
+        ADCP data with u on (z, time), either on the common grid or not yet
+        interpolated.
+    znew, tnew : np.ndarray, optional
+        Common depth and time vectors. Required for ADCPs that are not
+        interpolated yet. Default to all depths of the ADCPs and the time
+        vector of the first ADCP.
+
+    Returns
+    -------
+    xr.Dataset
+        Number of ADCPs with data (nadcp) on (z, time), number of valid
+        cells per ADCP (ncells), and for each pair of ADCPs the number of
+        overlapping cells (overlap_cells), the overlap duration (duration)
+        and the depth range of the overlap (zmin, zmax).
+    """
+    if znew is None:
+        znew = np.unique(np.concatenate([ai.z.data for ai in adcps]))
+    znew = np.asarray(znew)
+    tnew = adcps[0].time.data if tnew is None else np.asarray(tnew)
+    packed = np.stack([_packed_validity(ai, znew, tnew) for ai in adcps])
+    n = len(adcps)
+
+    count = np.zeros((znew.size, tnew.size), dtype=np.uint8)
+    for p in packed:
+        count += np.unpackbits(p, axis=-1, count=tnew.size)
+    ncells = masks.popcount(packed.reshape(n, -1), axis=1)
+
+    overlap_cells = np.zeros((n, n), dtype=np.int64)
+    steps = np.zeros((n, n), dtype=np.int64)
+    zmin = np.full((n, n), np.nan)
+    zmax = np.full((n, n), np.nan)
+    for i in range(n):
+        for j in range(i, n):
+            both = packed[i] & packed[j]
+            per_z = masks.popcount(both, axis=1)
+            overlap_cells[i, j] = per_z.sum()
+            # Time steps with overlap at any depth.
+            steps[i, j] = masks.popcount(np.bitwise_or.reduce(both, axis=0))
+            levels = znew[per_z > 0]
+            if levels.size > 0:
+                zmin[i, j], zmax[i, j] = levels.min(), levels.max()
+    for a in [overlap_cells, steps, zmin, zmax]:
+        lower = np.tril_indices(n, -1)
+        a[lower] = a.T[lower]
+
+    dt = np.median(np.diff(tnew)) if tnew.size > 1 else np.timedelta64(0, "s")
+    sns = [ai.attrs.get("sn", i) for i, ai in enumerate(adcps)]
+    out = xr.Dataset(
+        coords=dict(z=znew, time=tnew, adcp=sns, adcp2=sns),
+    )
+    out["nadcp"] = (("z", "time"), count)
+    out["ncells"] = ("adcp", ncells)
+    out["overlap_cells"] = (("adcp", "adcp2"), overlap_cells)
+    out["duration"] = (("adcp", "adcp2"), steps * dt)
+    out["zmin"] = (("adcp", "adcp2"), zmin)
+    out["zmax"] = (("adcp", "adcp2"), zmax)
+    return out
+
+
+def solar_elevation(time, lon, lat):
+    """Solar elevation angle [deg].
+
+    Uses the NOAA approximation of the equation of time and declination.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Time (UTC) as datetime64.
+    lon, lat : float
+        Location.
+
+    Returns
+    -------
+    np.ndarray
+        Solar elevation.
+    """
+    time = np.asarray(time, dtype="datetime64[s]")
+    year_start = time.astype("datetime64[Y]")
+    day = (time - year_start) / np.timedelta64(1, "D")
+    hour = (time - time.astype("datetime64[D]")) / np.timedelta64(1, "h")
+    g = 2 * np.pi / 365 * day
+    decl = (
+        0.006918
+        - 0.399912 * np.cos(g)
+        + 0.070257 * np.sin(g)
+        - 0.006758 * np.cos(2 * g)
+        + 0.000907 * np.sin(2 * g)
+        - 0.002697 * np.cos(3 * g)
+        + 0.00148 * np.sin(3 * g)
+    )
+    eqtime = 229.18 * (
+        0.000075
+        + 0.001868 * np.cos(g)
+        - 0.032077 * np.sin(g)
+        - 0.014615 * np.cos(2 * g)
+        - 0.040849 * np.sin(2 * g)
+    )
+    solar_time = hour * 60 + eqtime + 4 * lon
+    hour_angle = np.deg2rad(solar_time / 4 - 180)
+    phi = np.deg2rad(lat)
+    cos_zenith = np.sin(phi) * np.sin(decl) + np.cos(phi) * np.cos(
+        decl
+    ) * np.cos(hour_angle)
+    return 90 - np.rad2deg(np.arccos(np.clip(cos_zenith, -1, 1)))
+
+
+def _packed_validity(adcp, znew, tnew):
+    """Validity of u on the common grid, packed into bits along time."""
+    u = adcp.u.transpose("z", "time")
+    valid = u.notnull().data
+    z = u.z.data
+    if np.array_equal(u.time.data, tnew) and np.isin(z, znew).all():
+        # Already interpolated, possibly to a subset of the depth levels.
+        on_grid = np.zeros((znew.size, tnew.size), dtype=bool)
+        on_grid[np.searchsorted(znew, z)] = valid
+    else:
+        on_grid = masks.validity_on_grid(valid, z, u.time.data, znew, tnew)
+    return np.packbits(on_grid, axis=-1)
+
+
+def _cache_file(adcp, lon, lat):
+    source = adcp.encoding.get("source")
+    if source is None:
+        return None
+    time = adcp.time.data
+    return io.cache_file(
+        "coverage", source, time[0], time[-1], time.size, lon, lat
+    )
+
+
+@contextlib.contextmanager
+def _ignore_all_nan():
+    """Silence warnings about profiles without any valid data."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        yield
@@ -0,0 +1,116 @@
+"""
+Eddy kinetic energy from altimetry.
+"""
+
+import numpy as np
+import xarray as xr
+
+from . import io
+
+
+def eke(ssh):
+    """Eddy kinetic energy from geostrophic velocity anomalies.
+
+    Calculated as variance of eddy currents following Heywood et al. (1994).
+
+    Parameters
+    ----------
+    ssh : xr.Dataset
+        Altimetry data with ugosa and vgosa.
+
+    Returns
+    -------
+    xr.DataArray
+        EKE [m^2/s^2].
+    """
+    out = 1 / 2 * (ssh.ugosa**2 + ssh.vgosa**2)
+    out.attrs = dict(long_name="EKE", units="m$^2$/s$^2$")
+    return out
+
+
+def eke_statistics(ssh=None, time_block=365, cache=True) -> xr.Dataset:
+    """EKE time mean, standard deviation and monthly climatology.
+
+    The altimetry record is read in blocks of time and EKE sums, sums of
+    squares and counts are accumulated for each calendar month. All
+    statistics follow from these accumulators, so only one block is in
+    memory at a time. Results for the altimetry file defined in the config
+    are cached under data.cache.
+
+    Parameters
+    ----------
+    ssh : xr.Dataset, optional
+        Altimetry data with ugosa and vgosa, may be lazily loaded. Defaults
+        to the daily altimetry data read via `io.load_ssh`.
+    time_block : int, optional
+        Number of time steps read at once. Defaults to 365.
+    cache : bool, optional
+        Read from and write to the cache when using the default altimetry
+        data. Defaults to True.
+
+    Returns
+    -------
+    xr.Dataset
+        EKE mean, standard deviation and count over the whole record, and
+        monthly climatology with the same statistics per calendar month.
+    """
+    cfile = None
+    if ssh is None:
+        cfile = _cache_file() if cache else None
+        cached = io.read_cache(cfile)
+        if cached is not None:
+            return cached
+        ssh = io.load_ssh()
+
+    shape = (12, ssh.lat.size, ssh.lon.size)
+    acc_sum = np.zeros(shape)
+    acc_sumsq = np.zeros(shape)
+    acc_count = np.zeros(shape, dtype=np.int64)
+    for i in range(0, ssh.time.size, time_block):
+        block = ssh[["ugosa", "vgosa"]].isel(time=slice(i, i + time_block))
+        e = eke(block.load()).transpose("time", "lat", "lon").data
+        months = block.time.dt.month.data
+        for month in np.unique(months):
+            em = e[months == month]
+            valid = np.isfinite(em)
+            em = np.where(valid, em, 0)
+            acc_sum[month - 1] += em.sum(axis=0)
+            acc_sumsq[month - 1] += (em**2).sum(axis=0)
+            acc_count[month - 1] += valid.sum(axis=0)
+
+    coords = dict(month=np.arange(1, 13), lat=ssh.lat.data, lon=ssh.lon.data)
+    dims = ("month", "lat", "lon")
+    out = xr.Dataset(coords=coords)
+    out["eke_climatology"] = (dims, _mean(acc_sum, acc_count))
+    out["eke_climatology_std"] = (dims, _std(acc_sum, acc_sumsq, acc_count))
+    out["count_climatology"] = (dims, acc_count)
+    total = [a.sum(axis=0) for a in (acc_sum, acc_sumsq, acc_count)]
+    out["eke_mean"] = (("lat", "lon"), _mean(total[0], total[2]))
+    out["eke_std"] = (("lat", "lon"), _std(*total))
+    out["count"] = (("lat", "lon"), total[2])
+    for var in ["eke_climatology", "eke_climatology_std", "eke_mean", "eke_std"]:
+        out[var].attrs = dict(units="m$^2$/s$^2$")
+    out.attrs = dict(
+        time_start=str(ssh.time.data[0]), time_end=str(ssh.time.data[-1])
+    )
+
+    if cfile is not None:
+        io.write_cache(out, cfile)
+    return out
+
+
+def _mean(acc_sum, acc_count):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(acc_count > 0, acc_sum / acc_count, np.nan)
+
+
+def _std(acc_sum, acc_sumsq, acc_count):
+    mean = _mean(acc_sum, acc_count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = acc_sumsq / acc_count - mean**2
+    return np.sqrt(np.clip(var, 0, None))
+
+
+def _cache_file():
+    conf = io.load_config()
+    return io.cache_file("eke", conf.data.ssh.joinpath("mercator_ssh.nc"))
@@ -0,0 +1,196 @@
+"""
+EOF analysis for large fields.
+"""
+
+import numpy as np
+import xarray as xr
+
+
+class Eof:
+
+    """EOF analysis via randomized SVD over blocks of time."""
+
+    def __init__(
+        self,
+        da: xr.DataArray,
+        neofs: int = 10,
+        time_block: int = 365,
+        oversample: int = 10,
+        n_iter: int = 2,
+        seed: int = 0,
+    ):
+        """EOF analysis of a (time, ...) field.
+
+        The leading modes are found with a randomized SVD (Halko et al.,
+        2011) of the time-mean removed data matrix. The data are read in
+        blocks of time for every pass over the matrix, so memory use scales
+        with the block size and the number of modes rather than with the
+        length of the record. The interface follows `eofs.xarray.Eof`.
+        Spatial points with missing data at any time are excluded.
+
+        Parameters
+        ----------
+        da : xr.DataArray
+            Field with time as first dimension, may be lazily loaded.
+        neofs : int, optional
+            Number of modes to compute. Defaults to 10.
+        time_block : int, optional
+            Number of time steps read at once. Defaults to 365.
+        oversample : int, optional
+            Additional random vectors for the range finder. Defaults to 10.
+        n_iter : int, optional
+            Number of power iterations. Defaults to 2.
+        seed : int, optional
+            Random seed. Defaults to 0.
+        """
+        self.da = da.transpose("time", ...)
+        self.neofs = neofs
+        self.time_block = time_block
+        self.space_dims = self.da.dims[1:]
+        self.space_shape = self.da.shape[1:]
+        self.nt = self.da.time.size
+
+        self._column_statistics()
+        rng = np.random.default_rng(seed)
+        omega = rng.standard_normal((self.valid.sum(), neofs + oversample))
+        self._decompose(omega, n_iter)
+
+    def eofs_as_covariance(self, neofs=None):
+        """EOFs expressed as covariance between unit variance PCs and data.
+
+        Parameters
+        ----------
+        neofs : int, optional
+            Number of modes. Defaults to all computed modes.
+
+        Returns
+        -------
+        xr.DataArray
+            EOFs with dimensions (mode, ...).
+        """
+        neofs = self.neofs if neofs is None else neofs
+        scale = self.s[:neofs, np.newaxis] / np.sqrt(self.nt - 1)
+        return self._unflatten(self.vt[:neofs] * scale)
+
+    def eofs(self, neofs=None):
+        """Unit length EOFs.
+
+        Parameters
+        ----------
+        neofs : int, optional
+            Number of modes. Defaults to all computed modes.
+
+        Returns
+        -------
+        xr.DataArray
+            EOFs with dimensions (mode, ...).
+        """
+        neofs = self.neofs if neofs is None else neofs
+        return self._unflatten(self.vt[:neofs])
+
+    def pcs(self, npcs=None, pcscaling=0):
+        """Principal component time series.
+
+        Parameters
+        ----------
+        npcs : int, optional
+            Number of modes. Defaults to all computed modes.
+        pcscaling : {0, 1, 2}, optional
+            0 for unscaled PCs, 1 for PCs scaled to unit variance and 2 for
+            PCs multiplied by the square root of their eigenvalue. Defaults to
+            0.
+
+        Returns
+        -------
+        xr.DataArray
+            PCs with dimensions (time, mode).
+        """
+        npcs = self.neofs if npcs is None else npcs
+        pcs = self.u[:, :npcs] * self.s[:npcs]
+        eigenvalues = self.eigenvalues(npcs).data
+        if pcscaling == 1:
+            pcs = pcs / np.sqrt(eigenvalues)
+        elif pcscaling == 2:
+            pcs = pcs * np.sqrt(eigenvalues)
+        return xr.DataArray(
+            pcs,
+            coords=dict(time=self.da.time, mode=np.arange(npcs)),
+            dims=("time", "mode"),
+        )
+
+    def eigenvalues(self, neigs=None):
+        """Variance explained by each mode."""
+        neigs = self.neofs if neigs is None else neigs
+        return xr.DataArray(
+            self.s[:neigs] ** 2 / (self.nt - 1),
+            coords=dict(mode=np.arange(neigs)),
+            dims="mode",
+        )
+
+    def variance_fraction(self, neigs=None):
+        """Fraction of the total variance explained by each mode."""
+        neigs = self.neofs if neigs is None else neigs
+        return xr.DataArray(
+            self.s[:neigs] ** 2 / self.total_sumsq,
+            coords=dict(mode=np.arange(neigs)),
+            dims="mode",
+        )
+
+    def _blocks(self):
+        for i in range(0, self.nt, self.time_block):
+            block = self.da.isel(time=slice(i, i + self.time_block)).data
+            block = np.asarray(block).reshape(block.shape[0], -1)
+            yield i, block[:, self.valid] - self.mean
+
+    def _column_statistics(self):
+        npoints = int(np.prod(self.space_shape))
+        acc_sum = np.zeros(npoints)
+        acc_sumsq = np.zeros(npoints)
+        valid = np.ones(npoints, dtype=bool)
+        for i in range(0, self.nt, self.time_block):
+            block = self.da.isel(time=slice(i, i + self.time_block)).data
+            block = np.asarray(block).reshape(block.shape[0], -1)
+            valid &= np.isfinite(block).all(axis=0)
+            acc_sum += np.nan_to_num(block).sum(axis=0)
+            acc_sumsq += (np.nan_to_num(block) ** 2).sum(axis=0)
+        self.valid = valid
+        self.mean = acc_sum[valid] / self.nt
+        self.total_sumsq = (acc_sumsq[valid] - self.nt * self.mean**2).sum()
+
+    def _times(self, right):
+        """Data matrix times a (space, k) matrix, one block at a time."""
+        out = np.empty((self.nt, right.shape[1]))
+        for i, block in self._blocks():
+            out[i : i + block.shape[0]] = block @ right
+        return out
+
+    def _transpose_times(self, left):
+        """Transposed data matrix times a (time, k) matrix."""
+        out = np.zeros((self.mean.size, left.shape[1]))
+        for i, block in self._blocks():
+            out += block.T @ left[i : i + block.shape[0]]
+        return out
+
+    def _decompose(self, omega, n_iter):
+        q, _ = np.linalg.qr(self._times(omega))
+        for _ in range(n_iter):
+            z, _ = np.linalg.qr(self._transpose_times(q))
+            q, _ = np.linalg.qr(self._times(z))
+        b = self._transpose_times(q).T
+        ub, s, vt = np.linalg.svd(b, full_matrices=False)
+        u = q @ ub
+        # Make the sign of the EOFs deterministic.
+        sign = np.sign(vt[np.arange(vt.shape[0]), np.abs(vt).argmax(axis=1)])
+        self.u = (u * sign)[:, : self.neofs]
+        self.s = s[: self.neofs]
+        self.vt = (vt * sign[:, np.newaxis])[: self.neofs]
+
+    def _unflatten(self, flat):
+        out = np.full((flat.shape[0], self.valid.size), np.nan)
+        out[:, self.valid] = flat
+        out = out.reshape((flat.shape[0],) + self.space_shape)
+        coords = {
+            dim: self.da[dim] for dim in self.space_dims if dim in self.da.coords
+        }
+        coords["mode"] = np.arange(flat.shape[0])
+        return xr.DataArray(out, coords=coords, dims=("mode",) + self.space_dims)
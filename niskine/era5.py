@@ -0,0 +1,316 @@
+"""
+Retrieve and convert ERA5 reanalysis data.
+"""
+
+import calendar
+import concurrent.futures
+import datetime
+import threading
+from pathlib import Path
+import numpy as np
+import xarray as xr
+
+from . import io
+
+
+class RetrieveERA5:
+    def __init__(
+        self,
+        years=(2018, 2019, 2020),
+        area=(60, -27, 57, -19),
+        variables=("10m_u_component_of_wind", "10m_v_component_of_wind"),
+        client=None,
+        max_workers=4,
+        time_block=168,
+    ):
+        """Retrieve ERA5 single level data month by month.
+
+        Each month is requested separately from the Copernicus Climate Data
+        Store and the requests run concurrently. Every month is converted to
+        netcdf as soon as it arrives and its completion is recorded in a
+        manifest file so that an interrupted retrieval can simply be
+        restarted. Use `assemble()` to combine the monthly files into the
+        file defined as data.wind.era5 in the config file.
+
+        Parameters
+        ----------
+        years : list of int, optional
+            Years to retrieve. Defaults to 2018 through 2020.
+        area : list, optional
+            Bounding box [north, west, south, east]. Defaults to the NISKINe
+            mooring region.
+        variables : list of str, optional
+            ERA5 variable names. Defaults to 10m wind components.
+        client : object, optional
+            Object with a `retrieve(name, request, target)` method. Defaults to
+            `cdsapi.Client()`. The user key/api is read by cdsapi from
+            `~/.cdsapirc`.
+        max_workers : int, optional
+            Number of concurrent requests. Defaults to 4.
+        time_block : int, optional
+            Number of time steps converted at once and chunk size along time
+            in the netcdf files. Defaults to 168 (one week).
+        """
+        self.niskine_config = io.load_config()
+        self.years = list(years)
+        self.area = list(area)
+        self.variables = list(variables)
+        self.client = client if client is not None else _cds_client()
+        self.max_workers = max_workers
+        self.time_block = time_block
+
+        self.dir = self.niskine_config.data.wind.monthly
+        self.dir.mkdir(exist_ok=True, parents=True)
+        self.manifest_file = self.dir.joinpath("manifest.json")
+        self._lock = threading.Lock()
+        self._convert_lock = threading.Lock()
+        self.manifest = self._read_manifest()
+
+    def months(self):
+        """All (year, month) pairs covered by this retrieval."""
+        return [(year, month) for year in self.years for month in range(1, 13)]
+
+    def pending(self):
+        """(year, month) pairs that have not been retrieved yet."""
+        return [
+            (year, month)
+            for year, month in self.months()
+            if self.manifest.get(_key(year, month), {}).get("status") != "done"
+        ]
+
+    def monthly_file(self, year, month, suffix=".nc"):
+        return self.dir.joinpath(f"era5_{_key(year, month)}{suffix}")
+
+    def request(self, year, month):
+        """Generate the request dictionary for one month.
+
+        Parameters
+        ----------
+        year : int
+        month : int
+
+        Returns
+        -------
+        request : dict
+            cdsapi request.
+        """
+        ndays = calendar.monthrange(year, month)[1]
+        return {
+            "product_type": "reanalysis",
+            "format": "grib",
+            "variable": self.variables,
+            "year": [f"{year}"],
+            "month": [f"{month:02d}"],
+            "day": [f"{day:02d}" for day in range(1, ndays + 1)],
+            "time": [f"{hour:02d}:00" for hour in range(24)],
+            "area": self.area,
+        }
+
+    def retrieve_month(self, year, month):
+        """Retrieve and convert a single month.
+
+        Parameters
+        ----------
+        year : int
+        month : int
+
+        Returns
+        -------
+        ncfile : pathlib.Path
+            netcdf file with data for this month.
+        """
+        gribfile = self.monthly_file(year, month, suffix=".grib")
+        ncfile = self.monthly_file(year, month)
+        self._update_manifest(year, month, status="running")
+        try:
+            self.client.retrieve(
+                "reanalysis-era5-single-levels",
+                self.request(year, month),
+                gribfile.as_posix(),
+            )
+            # The HDF5 library is not thread safe. Downloads run concurrently
+            # but conversions happen one at a time.
+            with self._convert_lock:
+                grib_to_netcdf(gribfile, ncfile, time_block=self.time_block)
+            gribfile.unlink()
+        except Exception as e:
+            self._update_manifest(year, month, status="failed", error=repr(e))
+            raise
+        self._update_manifest(year, month, status="done", file=ncfile.name)
+        return ncfile
+
+    def retrieve(self):
+        """Retrieve all pending months concurrently.
+
+        Returns
+        -------
+        failed : dict
+            Exceptions for months that failed, keyed by 'YYYY-MM'. Run
+            `retrieve()` again to retry these.
+        """
+        failed = {}
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as pool:
+            futures = {
+                pool.submit(self.retrieve_month, year, month): _key(year, month)
+                for year, month in self.pending()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                if future.exception() is not None:
+                    failed[futures[future]] = future.exception()
+        return failed
+
+    def assemble(self, outfile=None):
+        """Combine monthly files into one netcdf file.
+
+        Parameters
+        ----------
+        outfile : str or pathlib.Path, optional
+            Output file. Defaults to data.wind.era5 from the config file.
+        """
+        if outfile is None:
+            outfile = self.niskine_config.data.wind.era5
+        if self.pending():
+            raise ValueError(f"months not retrieved yet: {self.pending()}")
+        files = [self.monthly_file(year, month) for year, month in self.months()]
+        write_time_blocks(_read_files(files), outfile, time_block=self.time_block)
+
+    def _read_manifest(self):
+        return io.read_json(self.manifest_file)
+
+    def _update_manifest(self, year, month, **entries):
+        entries["updated"] = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self.manifest[_key(year, month)] = entries
+            io.write_json(self.manifest_file, self.manifest, indent=2, sort_keys=True)
+
+
+def grib_to_netcdf(gribfile, outfile, time_block=168, complevel=4):
+    """Convert an ERA5 grib file to compressed netcdf or zarr.
+
+    The grib file is read and written in blocks of `time_block` time steps
+    such that memory use does not depend on the length of the record.
+
+    Parameters
+    ----------
+    gribfile : str or pathlib.Path
+        Input grib file.
+    outfile : str or pathlib.Path
+        Output file. Written to zarr if the file name ends in .zarr, netcdf
+        otherwise.
+    time_block : int, optional
+        Number of time steps read and written at once. This is also the chunk
+        size along time in the output file. Defaults to 168 (one week of
+        hourly data).
+    complevel : int, optional
+        zlib compression level for netcdf output. Defaults to 4.
+    """
+    # cache=False so that blocks already written are not kept in memory.
+    era5 = xr.open_dataset(gribfile, engine="cfgrib", cache=False)
+    era5 = _clean_up(era5)
+    blocks = (
+        era5.isel(time=slice(i, i + time_block))
+        for i in range(0, era5.time.size, time_block)
+    )
+    write_time_blocks(blocks, outfile, time_block=time_block, complevel=complevel)
+    era5.close()
+
+
+def write_time_blocks(blocks, outfile, time_block=168, complevel=4):
+    """Write consecutive time blocks into one compressed, time-chunked file.
+
+    Parameters
+    ----------
+    blocks : iterable of xr.Dataset
+        Datasets that are consecutive in time and otherwise have the same
+        structure. Each block is loaded into memory, written and released
+        before the next one is read.
+    outfile : str or pathlib.Path
+        Output file. Written to zarr if the file name ends in .zarr, netcdf
+        otherwise.
+    time_block : int, optional
+        Chunk size along time in the output file. Defaults to 168.
+    complevel : int, optional
+        zlib compression level for netcdf output. Defaults to 4.
+    """
+    outfile = Path(outfile)
+    zarr = outfile.suffix == ".zarr"
+    for i, block in enumerate(blocks):
+        block = block.load()
+        if zarr:
+            if i == 0:
+                block.chunk(dict(time=time_block)).to_zarr(outfile, mode="w")
+            else:
+                block.to_zarr(outfile, append_dim="time")
+        else:
+            if i == 0:
+                encoding = _netcdf_encoding(block, time_block, complevel)
+                block.to_netcdf(
+                    outfile, unlimited_dims=["time"], encoding=encoding
+                )
+            else:
+                _append_netcdf(block, outfile)
+        block.close()
+
+
+def _netcdf_encoding(ds, time_block, complevel):
+    encoding = dict(time=dict(units=_TIME_UNITS, dtype="float64"))
+    for var, da in ds.data_vars.items():
+        if "time" in da.dims:
+            chunksizes = [
+                time_block if dim == "time" else ds.sizes[dim] for dim in da.dims
+            ]
+            encoding[var] = dict(
+                zlib=True, complevel=complevel, chunksizes=chunksizes
+            )
+    return encoding
+
+
+def _append_netcdf(ds, ncfile):
+    import netCDF4
+
+    with netCDF4.Dataset(ncfile, "a") as nc:
+        n = nc.dimensions["time"].size
+        m = ds.time.size
+        nc["time"][n : n + m] = (
+            ds.time.data - np.datetime64(_TIME_UNITS[12:])
+        ) / np.timedelta64(1, "h")
+        for var, da in ds.data_vars.items():
+            if "time" in da.dims:
+                index = tuple(
+                    slice(n, n + m) if dim == "time" else slice(None)
+                    for dim in nc[var].dimensions
+                )
+                nc[var][index] = da.transpose(*nc[var].dimensions).data
+
+
+def _read_files(files):
+    for file in files:
+        with xr.open_dataset(file) as ds:
+            yield ds
+
+
+def _clean_up(era5):
+    """Make ERA5 data read from grib a little nicer to work with."""
+    era5 = era5.drop_vars(
+        ["number", "step", "surface", "valid_time"], errors="ignore"
+    )
+    era5 = era5.rename({"latitude": "lat", "longitude": "lon"})
+    era5.time.attrs = dict(long_name="time")
+    if "u10" in era5:
+        era5.u10.attrs = dict(long_name=r"u$_{\mathrm{10m}}$", units="m/s")
+    if "v10" in era5:
+        era5.v10.attrs = dict(long_name=r"v$_{\mathrm{10m}}$", units="m/s")
+    return era5
+
+
+def _cds_client():
+    import cdsapi
+
+    return cdsapi.Client()
+
+
+_TIME_UNITS = "hours since 1900-01-01 00:00:00"
+
+
+def _key(year, month):
+    return f"{year}-{month:02d}"
@@ -0,0 +1,186 @@
+"""
+Near-inertial filtering of mooring time series.
+"""
+
+import numpy as np
+import xarray as xr
+import gsw
+import scipy.fft
+import scipy.signal
+
+
+def inertial_frequency(lat):
+    """Inertial frequency [Hz] (absolute value, in cycles per second)."""
+    return np.abs(gsw.f(lat)) / (2 * np.pi)
+
+
+def bandpass_inertial(data, lat=None, band=(0.8, 1.2), ncycles=10, block=8192):
+    """Band-pass around the local inertial frequency.
+
+    Applies a zero-phase windowed-sinc FIR filter along time to all
+    variables with a time dimension, for all depths at once. Filtering is
+    done via FFT overlap-add in blocks of time. Missing data are set to zero
+    before filtering and masked again afterwards, which makes the filter
+    ring next to gaps; interpolate gaps first where this matters.
+
+    Parameters
+    ----------
+    data : xr.DataArray or xr.Dataset
+        Regularly sampled time series, for example a merged ADCP dataset.
+    lat : float, optional
+        Latitude. Defaults to the 'lat' attribute of `data`.
+    band : tuple, optional
+        Pass band in multiples of the inertial frequency. Defaults to (0.8,
+        1.2).
+    ncycles : float, optional
+        Filter length in inertial periods. Defaults to 10.
+    block : int, optional
+        Number of time steps per FFT block. Defaults to 8192.
+
+    Returns
+    -------
+    xr.DataArray or xr.Dataset
+        Band-passed data.
+    """
+    lat = data.attrs["lat"] if lat is None else lat
+    dt = dt_seconds(data.time)
+    f = inertial_frequency(lat)
+    h = scipy.signal.firwin(
+        _ntaps(ncycles / f, dt),
+        [band[0] * f, band[1] * f],
+        pass_zero=False,
+        fs=1 / dt,
+    )
+    return _apply(data, lambda x: fftfilt(h, x, block))
+
+
+def lowpass(data, cutoff, ntaps, block=8192):
+    """Zero-phase FIR low-pass filter along time.
+
+    Parameters
+    ----------
+    data : xr.DataArray or xr.Dataset
+        Regularly sampled time series.
+    cutoff : float
+        Cutoff frequency [Hz].
+    ntaps : int
+        Filter length. Increased by one if even.
+    block : int, optional
+        Number of time steps per FFT block. Defaults to 8192.
+
+    Returns
+    -------
+    xr.DataArray or xr.Dataset
+        Low-passed data.
+    """
+    dt = dt_seconds(data.time)
+    h = scipy.signal.firwin(ntaps // 2 * 2 + 1, cutoff, fs=1 / dt)
+    return _apply(data, lambda x: fftfilt(h, x, block))
+
+
+def complex_demodulation(
+    data, lat=None, frequency=None, bandwidth=0.5, ncycles=10, block=8192
+) -> xr.Dataset:
+    """Complex demodulation of horizontal velocity.
+
+    The rotary velocity w = u + iv is shifted by the demodulation frequency
+    and low-passed, resulting in the slowly varying complex amplitude of the
+    signal near that frequency.
+
+    Parameters
+    ----------
+    data : xr.Dataset
+        Dataset with u and v, for example a merged ADCP dataset.
+    lat : float, optional
+        Latitude. Defaults to the 'lat' attribute of `data`.
+    frequency : float, optional
+        Demodulation frequency [Hz]. Negative frequencies are clockwise.
+        Defaults to the clockwise inertial frequency in the northern
+        hemisphere.
+    bandwidth : float, optional
+        Low-pass cutoff in multiples of the inertial frequency. Defaults to
+        0.5.
+    ncycles : float, optional
+        Filter length in inertial periods. Defaults to 10.
+    block : int, optional
+        Number of time steps per FFT block. Defaults to 8192.
+
+    Returns
+    -------
+    xr.Dataset
+        Complex amplitude, amplitude [m/s] and phase [rad].
+    """
+    lat = data.attrs["lat"] if lat is None else lat
+    f = inertial_frequency(lat)
+    if frequency is None:
+        frequency = -f * np.sign(lat)
+    dt = dt_seconds(data.time)
+    t = (data.time - data.time[0]).data / np.timedelta64(1, "s")
+    w = data.u + 1j * data.v
+    shifted = w * np.exp(-2j * np.pi * frequency * t)
+    shifted.attrs = {}
+    amp = lowpass(shifted, bandwidth * f, _ntaps(ncycles / f, dt), block)
+    out = xr.Dataset(dict(complex_amplitude=amp))
+    out["amplitude"] = np.abs(amp)
+    out["amplitude"].attrs = dict(long_name="amplitude", units="m/s")
+    out["phase"] = xr.apply_ufunc(np.angle, amp)
+    out["phase"].attrs = dict(long_name="phase", units="rad")
+    out.attrs = dict(frequency=frequency, lat=lat)
+    return out
+
+
+def fftfilt(h, x, block=8192):
+    """Zero-phase FIR filter along the last axis via overlap-add.
+
+    Parameters
+    ----------
+    h : np.ndarray
+        Symmetric FIR filter of odd length.
+    x : np.ndarray
+        Data, filtered along the last axis. May be complex.
+    block : int, optional
+        Block length. Defaults to 8192.
+
+    Returns
+    -------
+    np.ndarray
+        Filtered data with the shape of `x`.
+    """
+    if np.iscomplexobj(x):
+        return fftfilt(h, x.real, block) + 1j * fftfilt(h, x.imag, block)
+    m = h.size
+    nt = x.shape[-1]
+    nfft = scipy.fft.next_fast_len(block + m - 1, real=True)
+    hf = scipy.fft.rfft(h, nfft)
+    out = np.zeros(x.shape[:-1] + (nt + m - 1,))
+    for i in range(0, nt, block):
+        seg = x[..., i : i + block]
+        n = seg.shape[-1] + m - 1
+        y = scipy.fft.irfft(scipy.fft.rfft(seg, nfft) * hf, nfft)
+        out[..., i : i + n] += y[..., :n]
+    delay = (m - 1) // 2
+    return out[..., delay : delay + nt]
+
+
+def dt_seconds(time):
+    """Median sampling period [s] of a time coordinate."""
+    return (time.diff(dim="time").median().data / np.timedelta64(1, "s")).item()
+
+
+def _apply(data, fun):
+    """Apply a filter along time to all variables with a time dimension."""
+    if isinstance(data, xr.Dataset):
+        out = data.copy()
+        for var, da in data.data_vars.items():
+            if "time" in da.dims:
+                out[var] = _apply(da, fun)
+        return out
+    da = data.transpose(..., "time")
+    valid = da.notnull()
+    filtered = fun(da.fillna(0).data)
+    return da.copy(data=filtered).where(valid).transpose(*data.dims)
+
+
+def _ntaps(period, dt):
+    """Odd number of taps covering the given period [s]."""
+    return int(period / dt) // 2 * 2 + 1
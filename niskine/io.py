@@ -4,13 +4,13 @@ Read and write data.
 
 from pathlib import Path
 import collections.abc
+import hashlib
+import json
+import os
+import tempfile
 import numpy as np
 import yaml
 from box import Box
-import gvpy as gv
-import getpass
-import motuclient, motu_utils
-import logging
 import xarray as xr
 
 
@@ -62,10 +62,134 @@ def load_config() -> Box:
 
 
 def print_config(print_values=False):
+    import gvpy as gv
+
     config = load_config()
     gv.misc.pretty_print(config, print_values=print_values)
 
 
+def fingerprint(*key) -> str:
+    """Hash of a key for caching.
+
+    Files, given as pathlib.Path, are represented by their resolved path,
+    size and modification time, and arrays by their content.
+
+    Returns
+    -------
+    str
+        sha1 hex digest.
+    """
+    h = hashlib.sha1()
+    for k in key:
+        if isinstance(k, Path):
+            stat = k.stat()
+            k = [k.resolve(), stat.st_size, stat.st_mtime_ns]
+        elif isinstance(k, np.ndarray):
+            h.update(np.ascontiguousarray(k).tobytes())
+            k = [k.dtype, k.shape]
+        h.update(repr(k).encode())
+    return h.hexdigest()
+
+
+def cache_file(kind, source=None, *key, suffix=".nc") -> Path:
+    """Path of a cached intermediate product under data.cache.
+
+    Parameters
+    ----------
+    kind : str
+        Type of product, used as subdirectory.
+    source : str or pathlib.Path, optional
+        Source data file. The cache file changes with the file's size and
+        modification time.
+    *key
+        Further parameters the cached product depends on, see
+        `fingerprint`.
+    suffix : str, optional
+        File extension. Defaults to '.nc'.
+
+    Returns
+    -------
+    pathlib.Path
+        Cache file.
+    """
+    conf = load_config()
+    if source is not None:
+        source = Path(source)
+        key = (source,) + key
+    stem = kind if source is None else source.stem
+    digest = fingerprint(*key)[:12]
+    return conf.data.cache.joinpath(kind, f"{stem}_{digest}{suffix}")
+
+
+def read_cache(cfile):
+    """Read a cached dataset.
+
+    Returns
+    -------
+    xr.Dataset or None
+        Cached data, None if the cache file does not exist or cannot be
+        read.
+    """
+    if cfile is None or not cfile.exists():
+        return None
+    try:
+        with xr.open_dataset(cfile) as ds:
+            return ds.load()
+    except (OSError, ValueError, RuntimeError):
+        return None
+
+
+def write_cache(ds, cfile):
+    """Write a dataset to the cache, see `write_atomic`."""
+    write_atomic(cfile, ds.to_netcdf)
+
+
+def read_json(file, default=None):
+    """Read a json file, `default` if it does not exist or is incomplete."""
+    try:
+        with open(file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {} if default is None else default
+
+
+def write_json(file, obj, **kwargs):
+    """Write a json file, see `write_atomic`."""
+
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(obj, f, **kwargs)
+
+    write_atomic(file, write)
+
+
+def write_atomic(file, write):
+    """Write a file via a temporary file and rename it into place.
+
+    Concurrent readers see either the old or the complete new file, never
+    a partially written one.
+
+    Parameters
+    ----------
+    file : str or pathlib.Path
+        File to write.
+    write : callable
+        Function that writes to the temporary file path given as argument.
+    """
+    file = Path(file)
+    file.parent.mkdir(exist_ok=True, parents=True)
+    fd, tmp = tempfile.mkstemp(
+        dir=file.parent, prefix=f".{file.stem}.", suffix=file.suffix
+    )
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, file)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
 def link_proc_adcp(mooringdir):
     """Link processed ADCP data files into package data directory.
 
@@ -269,6 +393,8 @@ class RetrieveMercatorData:
         options_dict : dict
             Default parameters will be updated from the options provided here.
         """
+        import motuclient, motu_utils
+
         self._parse_parameters_dict(options_dict)
         motuclient.motu_api.execute_request(_MotuOptions(self.parameters))
 
@@ -296,6 +422,8 @@ class RetrieveMercatorData:
             with open(mercator_credentials_file) as file:
                 username, password = [line.rstrip() for line in file]
         else:
+            import getpass
+
             print("sign up for a user account at https://marine.copernicus.eu/")
             print("and provide your credentials here.")
             username = input("Enter your username: ")
@@ -0,0 +1,248 @@
+"""
+Validity masks of gappy data.
+"""
+
+import numpy as np
+
+# Number of set bits of every byte value.
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1)
+_POPCOUNT = _POPCOUNT.sum(axis=1).astype(np.uint8)
+
+# interp_by_mask interpolates profile by profile if there are more validity
+# patterns than this fraction of the number of profiles.
+_MAX_GROUP_FRACTION = 1 / 8
+
+
+def group_by_mask(valid):
+    """Group profiles by their pattern of valid data.
+
+    Parameters
+    ----------
+    valid : np.ndarray
+        Boolean validity mask of shape (z, profiles).
+
+    Returns
+    -------
+    patterns : np.ndarray
+        Unique validity patterns, shape (groups, z).
+    groups : list of np.ndarray
+        Indices of the profiles belonging to each pattern.
+    """
+    nz = valid.shape[0]
+    # Pack each profile's mask into bytes and compare those as single items.
+    packed = np.ascontiguousarray(np.packbits(valid.T, axis=1))
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    patterns = np.unpackbits(packed[first], axis=1, count=nz).astype(bool)
+    order = np.argsort(inverse, kind="stable")
+    splits = np.cumsum(np.bincount(inverse, minlength=first.size))[:-1]
+    return patterns, np.split(order, splits)
+
+
+def interpolation_matrix(src, dst):
+    """Linear interpolation weights between two coordinate vectors.
+
+    Parameters
+    ----------
+    src : np.ndarray
+        Monotonically increasing source coordinate.
+    dst : np.ndarray
+        Target coordinate.
+
+    Returns
+    -------
+    weights : np.ndarray
+        Weights of shape (dst, src). Rows are zero for target points outside
+        the range of the source coordinate.
+    support : np.ndarray
+        Boolean array of shape (dst, src) marking the two source points that
+        bracket each target point.
+    """
+    src = np.asarray(src, dtype=float)
+    dst = np.asarray(dst, dtype=float)
+    weights = np.zeros((dst.size, src.size))
+    support = np.zeros((dst.size, src.size), dtype=bool)
+    rows, lo, hi = bracket(src, dst)
+    if src.size == 1:
+        weights[rows, 0] = 1
+        support[rows, 0] = True
+        return weights, support
+    frac = (dst[rows] - src[lo]) / (src[hi] - src[lo])
+    weights[rows, lo] = 1 - frac
+    weights[rows, hi] = frac
+    support[rows, lo] = True
+    support[rows, hi] = True
+    return weights, support
+
+
+def bracket(src, dst):
+    """Source points bracketing each target point.
+
+    Matches scipy's interp1d, which is used by xarray's interp: a target
+    point that coincides with a source point is bracketed by that point
+    and the one below it, except at the first source point, which is
+    bracketed by itself and the one above it. The bracketing thus depends
+    on the source points present, including ones without data.
+
+    Parameters
+    ----------
+    src : np.ndarray
+        Monotonically increasing source coordinate.
+    dst : np.ndarray
+        Target coordinate.
+
+    Returns
+    -------
+    rows : np.ndarray
+        Indices of the target points within the range of the source
+        coordinate.
+    lo, hi : np.ndarray
+        Indices of the bracketing source points for these target points.
+    """
+    rows = np.flatnonzero((dst >= src[0]) & (dst <= src[-1]))
+    if src.size == 1:
+        zero = np.zeros(rows.size, dtype=int)
+        return rows, zero, zero
+    lo = np.clip(np.searchsorted(src, dst[rows]) - 1, 0, src.size - 2)
+    return rows, lo, lo + 1
+
+
+def validity_on_grid(valid, z, time, znew, tnew):
+    """Validity of data linearly interpolated in time and then in depth.
+
+    Gives the mask of valid data that interpolating to a new grid would
+    result in without interpolating the data.
+
+    Parameters
+    ----------
+    valid : np.ndarray
+        Boolean validity mask of shape (z, time).
+    z, time : np.ndarray
+        Monotonically increasing coordinates of `valid`.
+    znew, tnew : np.ndarray
+        New coordinates.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean validity mask of shape (znew, tnew).
+    """
+    out = np.zeros((np.size(znew), np.size(tnew)), dtype=bool)
+    tnew = np.asarray(tnew, dtype=np.asarray(time).dtype)
+    cols, tlo, thi = bracket(np.asarray(time), tnew)
+    rows, zlo, zhi = bracket(np.asarray(z, dtype=float), np.asarray(znew, dtype=float))
+    vt = valid[:, tlo] & valid[:, thi]
+    out[np.ix_(rows, cols)] = vt[zlo] & vt[zhi]
+    return out
+
+
+def popcount(packed, axis=None):
+    """Number of set bits in an array of packed bits.
+
+    Parameters
+    ----------
+    packed : np.ndarray
+        uint8 array as returned by np.packbits.
+    axis : int, optional
+        Axis to sum over. Defaults to all.
+
+    Returns
+    -------
+    int or np.ndarray
+        Number of set bits.
+    """
+    return _POPCOUNT[packed].sum(axis=axis)
+
+
+def interp_by_mask(x, src, dst, fill=False):
+    """Linearly interpolate gappy profiles, one validity pattern at a time.
+
+    Profiles are grouped by their pattern of valid data. Interpolation
+    weights are computed once per pattern and applied to all profiles of
+    the group in a single matrix product. With scattered missing data
+    nearly every profile has its own pattern; if the number of patterns is
+    a large fraction of the number of profiles, all profiles are
+    interpolated at once from their bracketing valid points instead.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Profiles of shape (src, profiles).
+    src : np.ndarray
+        Monotonic source coordinate.
+    dst : np.ndarray
+        Target coordinate.
+    fill : bool, optional
+        If False, a target point is missing when one of its bracketing
+        source points is missing, as in xarray's `interp`. If True,
+        interpolate between valid source points only, filling interior gaps
+        as xarray's `interpolate_na` does. Defaults to False.
+
+    Returns
+    -------
+    np.ndarray
+        Interpolated profiles of shape (dst, profiles) with the floating
+        point precision of `x`.
+    """
+    order = np.argsort(src)
+    src = np.asarray(src, dtype=float)[order]
+    x = np.asarray(x)[order]
+    if x.dtype.kind != "f":
+        x = x.astype(float)
+    valid = np.isfinite(x)
+    patterns, groups = group_by_mask(valid)
+    if len(groups) > _MAX_GROUP_FRACTION * x.shape[1]:
+        return _interp_profiles(x, valid, src, np.asarray(dst, dtype=float), fill)
+    out = np.full((np.size(dst), x.shape[1]), np.nan, dtype=x.dtype)
+    if not fill:
+        weights, support = interpolation_matrix(src, dst)
+    for pattern, profiles in zip(patterns, groups):
+        if not pattern.any():
+            continue
+        if fill:
+            w, support_p = interpolation_matrix(src[pattern], dst)
+            rows = support_p.any(axis=1)
+        else:
+            w = weights[:, pattern]
+            rows = support.any(axis=1) & ~support[:, ~pattern].any(axis=1)
+        w = w[rows].astype(x.dtype)
+        out[np.ix_(rows, profiles)] = w @ x[np.ix_(pattern, profiles)]
+    return out
+
+
+def _interp_profiles(x, valid, src, dst, fill):
+    """Profile by profile version of `interp_by_mask` for sorted `src`."""
+    out = np.full((dst.size, x.shape[1]), np.nan, dtype=x.dtype)
+    if not fill:
+        rows, lo, hi = bracket(src, dst)
+        if src.size == 1:
+            out[rows] = x[lo]
+            return out
+        frac = ((dst[rows] - src[lo]) / (src[hi] - src[lo])).astype(x.dtype)
+        frac = frac[:, np.newaxis]
+        # Missing bracketing points propagate as NaN.
+        out[rows] = (1 - frac) * x[lo] + frac * x[hi]
+        return out
+
+    # Last valid point below and first valid point at or above each target
+    # point, as for interpolation between the valid points only.
+    n = src.size
+    index = np.arange(n)[:, np.newaxis]
+    below = np.maximum.accumulate(np.where(valid, index, -1), axis=0)
+    above = np.minimum.accumulate(np.where(valid, index, n)[::-1], axis=0)[::-1]
+    below = np.concatenate([np.full((1, x.shape[1]), -1), below])
+    above = np.concatenate([above, np.full((1, x.shape[1]), n)])
+    j = np.searchsorted(src, dst)
+    lo, hi = below[j], above[j]
+    has_lo, has_hi = lo >= 0, hi < n
+    lo, hi = np.clip(lo, 0, n - 1), np.clip(hi, 0, n - 1)
+    profiles = np.arange(x.shape[1])
+    xlo, xhi = x[lo, profiles], x[hi, profiles]
+    slo, shi = src[lo], src[hi]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(has_lo, (dst[:, np.newaxis] - slo) / (shi - slo), 1)
+    frac = frac.astype(x.dtype)
+    ok = has_hi & (has_lo | (shi == dst[:, np.newaxis]))
+    out[ok] = np.where(has_lo, (1 - frac) * xlo, 0)[ok] + (frac * xhi)[ok]
+    return out
@@ -4,11 +4,10 @@ Merge ADCP data for a mooring.
 
 from pathlib import Path
 import numpy as np
-import gvpy as gv
 import xarray as xr
 import gsw
 
-from . import io
+from . import consistency, coverage, io, masks
 
 
 class MergeADCP:
@@ -25,6 +24,9 @@ class MergeADCP:
         stop=None,
         method="simple",
         dropna=True,
+        precision="float64",
+        validate=False,
+        resample="linear",
     ):
         """Merge
 
@@ -50,6 +52,15 @@ class MergeADCP:
             Merge method. Defaults to simple.
         dropna : bool, optional
             Drop depth levels with no data, defaults to True.
+        precision : {'float64', 'float32'}, optional
+            Floating point precision used throughout the merge. float32
+            halves memory use. Defaults to float64.
+        validate : bool, optional
+            Also merge in float64 and report the maximum difference per
+            variable in `precision_error`. Defaults to False.
+        resample : {'linear', 'mean', 'nearest'}, optional
+            Method for bringing each ADCP onto the new time vector, see
+            `interpolate_time`. Defaults to linear interpolation.
         """
 
         self.mooring = mooring
@@ -59,11 +70,24 @@ class MergeADCP:
         self.start = start
         self.stop = stop
         self.method = method
+        self.precision = precision
+        self.resample = resample
 
         self.all_adcps = load_mooring_adcps(self.mooring)
         self.adcps = select_adcps(self.all_adcps, self.min_end_time)
         self.adcps = at_depth_only(self.adcps, self.mooring)
         self.adcps_sorted = sort_in_depth(self.adcps)
+        self.adcps_sorted = set_precision(self.adcps_sorted, self.precision)
+
+        print("coverage...")
+        lon, lat, _ = io.mooring_location(self.mooring)
+        self.coverage = [
+            coverage.coverage_index(ai, lon, lat) for ai in self.adcps_sorted
+        ]
+        self.adcps_sorted, self.coverage = trim_to_coverage(
+            self.adcps_sorted, self.coverage
+        )
+        self.zextent = [coverage.valid_z_extent(ci) for ci in self.coverage]
 
         print("sampling periods")
         print_sampling_period(self.adcps_sorted)
@@ -72,19 +96,42 @@ class MergeADCP:
         self.znew = self.generate_depth_vector()
 
         print("interpolating time...")
-        self.adcps_sorted_ti = interpolate_time(self.adcps_sorted, self.tnew)
+        self.adcps_sorted_ti = interpolate_time(
+            self.adcps_sorted, self.tnew, self.resample
+        )
+        self.adcps_sorted_ti = set_precision(self.adcps_sorted_ti, self.precision)
 
         print("interpolating depth...")
         self.adcps_sorted_ti_zi = interpolate_depth(
-            self.adcps_sorted_ti, self.znew
+            self.adcps_sorted_ti, self.znew, self.zextent
         )
 
         print("merging...")
         self.pick_merge_method()
         self.merge_adcps()
 
+        # Each ADCP was only interpolated to the depth levels it covers and
+        # the merged data span the union of these levels.
         if dropna:
-            self.merged = _dropna(self.merged)
+            self.merged = _dropna(self.merged.sortby("z"))
+        else:
+            self.merged = self.merged.reindex(z=self.znew)
+
+        if validate and self.precision != "float64":
+            print("merging in float64 for validation...")
+            reference = MergeADCP(
+                mooring,
+                dt_min=dt_min,
+                dz_m=dz_m,
+                min_end_time=min_end_time,
+                start=start,
+                stop=stop,
+                method=method,
+                dropna=dropna,
+                resample=resample,
+            )
+            self.precision_error = precision_error(self.merged, reference.merged)
+            print(self.precision_error)
 
     def generate_time_vector(self):
         time_span = io.mooring_start_end_time(mooring=self.mooring)
@@ -118,6 +165,9 @@ class MergeADCP:
     def fill_gaps(self):
         self.mergedf = fill_gaps(self.merged)
 
+    def compare_adcps(self):
+        self.consistency = consistency.consistency_metrics(self.adcps_sorted_ti_zi)
+
 
 def load_mooring_adcps(mooring: int) -> list[xr.Dataset]:
     conf = io.load_config()
@@ -130,7 +180,7 @@ def select_adcps(adcps: list[xr.Dataset], longer_than) -> list[xr.Dataset]:
     if type(longer_than) == str:
         longer_than = np.datetime64(longer_than)
     if longer_than is not None:
-        return [ai for ai in adcps if ai.time.isel(time=-1) > longer_than]
+        return [ai for ai in adcps if adcp_summary(ai)["end"] > longer_than]
     else:
         return adcps
 
@@ -141,35 +191,149 @@ def at_depth_only(adcps: list[xr.Dataset], mooring: int) -> list[xr.Dataset]:
 
 
 def sort_in_depth(adcps: list[xr.Dataset]) -> list[xr.Dataset]:
-    mean_p = [ai.pressure.mean().data for ai in adcps]
+    mean_p = [adcp_summary(ai)["mean_pressure"] for ai in adcps]
     return [adcps[i] for i in np.argsort(mean_p)]
 
 
+def adcp_summary(adcp) -> dict:
+    """First and last time, median sampling period and mean pressure.
+
+    Summaries of ADCPs read from file are stored in a hidden json file next
+    to the data file, keyed by time range, and are only recalculated when
+    the data file changes.
+
+    Parameters
+    ----------
+    adcp : xr.Dataset
+        ADCP data.
+
+    Returns
+    -------
+    dict
+        start and end time, median sampling period dt and mean_pressure.
+    """
+    time = adcp.time.data
+    key = f"{time[0]}/{time[-1]}/{time.size}"
+    sfile, stored = _read_summary(adcp)
+    if key not in stored["summaries"]:
+        dt = np.median(np.diff(time)) if time.size > 1 else np.timedelta64("NaT")
+        pressure = adcp.pressure.mean().item() if "pressure" in adcp else np.nan
+        stored["summaries"][key] = dict(
+            start=str(time[0]),
+            end=str(time[-1]),
+            dt_ns=int(dt / np.timedelta64(1, "ns")) if time.size > 1 else None,
+            mean_pressure=float(pressure),
+        )
+        _write_summary(sfile, stored)
+    summary = stored["summaries"][key]
+    dt_ns = summary["dt_ns"]
+    return dict(
+        start=np.datetime64(summary["start"]),
+        end=np.datetime64(summary["end"]),
+        dt=np.timedelta64("NaT") if dt_ns is None else np.timedelta64(dt_ns, "ns"),
+        mean_pressure=summary["mean_pressure"],
+    )
+
+
+def trim_to_coverage(
+    adcps: list[xr.Dataset], index: list[xr.Dataset]
+) -> tuple[list[xr.Dataset], list[xr.Dataset]]:
+    """Drop leading and trailing depth bins that never have data.
+
+    This avoids interpolating bins that are all NaN. One empty bin is kept
+    on either side: a new depth level that falls exactly on the first or
+    last valid bin is bracketed by that bin and its empty neighbour, and
+    is therefore missing, see `masks.bracket`. Dropping the neighbour would
+    make these levels valid and change the merged result. ADCPs without any
+    data are dropped together with their coverage index.
+    """
+    adcps_out, index_out = [], []
+    for ai, ci in zip(adcps, index):
+        zrange = coverage.valid_z_range(ci)
+        if zrange is not None:
+            zrange = slice(max(zrange.start - 1, 0), zrange.stop + 1)
+            adcps_out.append(ai.isel(z=zrange))
+            index_out.append(ci.isel(z=zrange))
+    return adcps_out, index_out
+
+
 def print_sampling_period(adcps: list[xr.Dataset]):
     def find_sampling_period(adcpi):
-        dt = adcpi.time.diff(dim="time").median()
-        dt = np.timedelta64(dt.data, "s")
+        dt = adcp_summary(adcpi)["dt"]
+        dt = np.timedelta64(dt, "s")
         return dt
 
     [print(ai.attrs["sn"], ":", find_sampling_period(ai)) for ai in adcps]
 
 
 def interpolate_time(
-    adcps: list[xr.Dataset], tnew: np.ndarray
+    adcps: list[xr.Dataset], tnew: np.ndarray, method="linear"
 ) -> list[xr.Dataset]:
-    return [ai.interp(time=tnew) for ai in adcps]
+    """Bring ADCPs onto a new time vector.
+
+    Parameters
+    ----------
+    adcps : list of xr.Dataset
+        ADCP data.
+    tnew : np.ndarray
+        Regular time vector.
+    method : {'linear', 'mean', 'nearest'}, optional
+        Linear interpolation, average over bins of the time step centered
+        on `tnew`, or nearest sample. Bin-averaging falls back to linear
+        interpolation for ADCPs that sample more slowly than the new time
+        step. Defaults to 'linear'.
+
+    Returns
+    -------
+    list of xr.Dataset
+        ADCP data on the new time vector.
+    """
+    if method == "linear":
+        return [ai.interp(time=tnew) for ai in adcps]
+    elif method == "nearest":
+        return [_apply_along_time(ai, tnew, _nearest) for ai in adcps]
+    elif method == "mean":
+        dt = np.median(np.diff(tnew))
+        return [
+            _apply_along_time(ai, tnew, _bin_average)
+            if adcp_summary(ai)["dt"] < dt
+            else ai.interp(time=tnew)
+            for ai in adcps
+        ]
+    raise ValueError(f"unknown resampling method {method}")
 
 
 def interpolate_depth(
-    adcps: list[xr.Dataset], znew: np.ndarray
+    adcps: list[xr.Dataset], znew: np.ndarray, extents=None
 ) -> list[xr.Dataset]:
-    return [ai.interp(z=znew) for ai in adcps]
+    """Interpolate ADCPs in depth.
+
+    Parameters
+    ----------
+    adcps : list of xr.Dataset
+        ADCP data.
+    znew : np.ndarray
+        Depth vector.
+    extents : list of tuple, optional
+        Valid depth extent (zmin, zmax) of each ADCP. If provided, each ADCP
+        is only interpolated to the levels of `znew` within its extent.
+
+    Returns
+    -------
+    list of xr.Dataset
+        Interpolated ADCP data.
+    """
+    if extents is None:
+        return [_interp_z(ai, znew) for ai in adcps]
+    return [
+        _interp_z(ai, znew[(znew >= zmin) & (znew <= zmax)])
+        for ai, (zmin, zmax) in zip(adcps, extents)
+    ]
 
 
-def determine_overlap(adcps_interp):
-    tmp = [ai.u for ai in adcps_interp]
-    tmp = xr.concat(tmp, dim="adcp")
-    return tmp.where(np.isnan(tmp), other=1)
+def determine_overlap(adcps_interp, znew=None, tnew=None):
+    """Overlap statistics of ADCPs, see `coverage.overlap_statistics`."""
+    return coverage.overlap_statistics(adcps_interp, znew, tnew)
 
 
 def simple_merge(adcps_interp):
@@ -184,7 +348,7 @@ def simple_merge(adcps_interp):
 
 def median_merge(adcps_interp):
     adcps_interp = [remove_extra_variables(ai) for ai in adcps_interp]
-    tmp = xr.concat(adcps_interp, dim="adcp")
+    tmp = xr.concat(adcps_interp, dim="adcp", join="outer")
     return tmp.median(dim="adcp", keep_attrs=True)
 
 
@@ -195,7 +359,10 @@ def spline_merge(adcps_interp):
 def fill_gaps(merged):
     merged = _drop_variable(merged, "w")
     for var in ["u", "v"]:
-        merged[var] = merged[var].interpolate_na(dim="z")
+        merged[var] = _apply_along_z(
+            merged[var],
+            lambda x: masks.interp_by_mask(x, merged.z, merged.z, fill=True),
+        )
     return merged
 
 
@@ -220,9 +387,19 @@ def remove_extra_variables(merged):
 
 
 def add_auxilliary_data(adcps_interp, merged):
-    zz = [_p_to_depth(ai.pressure, merged.attrs["lat"]) for ai in adcps_interp]
-    merged["xducer_depth"] = (("adcp", "time"), zz)
-    temp = [ai.temperature for ai in adcps_interp]
+    """Add transducer depth and temperature of each ADCP on (adcp, time).
+
+    Pressure and temperature of all ADCPs are stacked into preallocated
+    arrays and pressure is converted to depth in a single call.
+    """
+    shape = (len(adcps_interp), merged.time.size)
+    p = np.empty(shape, dtype=merged.u.dtype)
+    temp = np.empty(shape, dtype=merged.u.dtype)
+    for i, ai in enumerate(adcps_interp):
+        p[i] = ai.pressure.data
+        temp[i] = ai.temperature.data
+    merged["xducer_depth"] = (("adcp", "time"), _p_to_depth(p, merged.attrs["lat"]))
+    merged.xducer_depth.attrs = dict(long_name="depth", units="m")
     merged["temperature"] = (("adcp", "time"), temp)
     sns = [ai.attrs["sn"] for ai in adcps_interp]
     merged.coords["adcp"] = (("adcp"), sns)
@@ -230,7 +407,7 @@ def add_auxilliary_data(adcps_interp, merged):
 
 
 def add_mooring_metadata(merged, mooring: int):
-    lon, lat, depth = io.mooring_location(1)
+    lon, lat, depth = io.mooring_location(mooring)
     merged.attrs = dict(
         project="NISKINe",
         mooring=f"M{mooring}",
@@ -241,29 +418,258 @@ def add_mooring_metadata(merged, mooring: int):
     return merged
 
 
-def save_merged(merged, suffix=None):
-    conf = io.load_config()
-    conf.data.gridded.adcp.mkdir(exist_ok=True, parents=True)
-    filename = f"{merged.attrs['mooring']}_gridded.nc"
-    savename = conf.data.gridded.adcp.joinpath(filename)
-    if suffix is not None:
-        savename = savename.parent.joinpath(
-            savename.stem + "_" + suffix + savename.suffix
-        )
+def save_merged(merged, suffix=None, packing=None):
+    """Save merged ADCP data to the gridded data directory.
+
+    Parameters
+    ----------
+    merged : xr.Dataset
+        Merged ADCP data.
+    suffix : str, optional
+        Suffix appended to the file name.
+    packing : {None, 'int16'}, optional
+        Store velocity, transducer depth and temperature as int16 with scale
+        factors from `PACKING` instead of as floating point numbers. See
+        `precision_error` for the resulting error. Defaults to None.
+    """
+    savename = gridded_file(merged.attrs["mooring"], suffix)
+    savename.parent.mkdir(exist_ok=True, parents=True)
+    encoding = _packing_encoding(merged) if packing == "int16" else None
     merged.to_netcdf(
         savename,
+        encoding=encoding,
     )
 
 
+def save_consistency_report(metrics, mooring, suffix=None):
+    """Save ADCP consistency metrics next to the merged ADCP file.
+
+    Parameters
+    ----------
+    metrics : xr.Dataset
+        Metrics as returned by `consistency.consistency_metrics`.
+    mooring : int or str
+        Mooring number or name.
+    suffix : str, optional
+        Suffix of the merged ADCP file.
+
+    Returns
+    -------
+    pathlib.Path
+        csv file with one line per overlapping pair of ADCPs.
+    """
+    merged_file = gridded_file(mooring, suffix)
+    savename = merged_file.with_name(merged_file.stem + "_consistency.csv")
+    savename.parent.mkdir(exist_ok=True, parents=True)
+    consistency.consistency_report(metrics).to_csv(
+        savename, index=False, float_format="%.4g"
+    )
+    return savename
+
+
+def gridded_file(mooring, suffix=None) -> Path:
+    """Path of a merged ADCP file.
+
+    Parameters
+    ----------
+    mooring : int or str
+        Mooring number or name, e.g. 1 or 'M1'.
+    suffix : str, optional
+        Suffix appended to the file name.
+
+    Returns
+    -------
+    pathlib.Path
+        File in the gridded data directory.
+    """
+    conf = io.load_config()
+    name = f"M{mooring}" if isinstance(mooring, int) else mooring
+    filename = f"{name}_gridded.nc" if suffix is None else f"{name}_gridded_{suffix}.nc"
+    return conf.data.gridded.adcp.joinpath(filename)
+
+
+# Scale factors for storing variables as int16.
+PACKING = dict(u=1e-4, v=1e-4, w=1e-4, xducer_depth=0.1, temperature=1e-3)
+
+
+def set_precision(adcps: list[xr.Dataset], precision) -> list[xr.Dataset]:
+    """Convert all floating point variables to the given precision."""
+    dtype = np.dtype(precision)
+    out = []
+    for ai in adcps:
+        converted = ai.map(lambda da: da.astype(dtype) if da.dtype.kind == "f" else da)
+        converted.encoding = ai.encoding
+        out.append(converted)
+    return out
+
+
+def precision_error(merged, reference=None, packing=None) -> dict:
+    """Maximum absolute error of a reduced precision merged product.
+
+    Parameters
+    ----------
+    merged : xr.Dataset
+        Merged ADCP data.
+    reference : xr.Dataset, optional
+        Same data merged in float64. If not provided, the error of storing
+        `merged` with the given packing is reported.
+    packing : {None, 'int16'}, optional
+        Include the error due to packing into int16 with `PACKING`.
+
+    Returns
+    -------
+    dict
+        Maximum absolute error for each variable.
+    """
+    reference = merged if reference is None else reference
+    error = {}
+    for var in PACKING:
+        if var not in merged or var not in reference:
+            continue
+        x = merged[var].astype(np.float64)
+        if packing == "int16":
+            x = np.round(x / PACKING[var]) * PACKING[var]
+        error[var] = float(np.abs(x - reference[var]).max())
+    return error
+
+
 def _drop_variable(ds, var):
     return ds.drop(var) if var in ds else ds
 
 
+def _read_summary(adcp):
+    """Summary file and its content, empty if the data file has changed."""
+    source = adcp.encoding.get("source")
+    if source is None:
+        return None, dict(stat=None, summaries={})
+    source = Path(source)
+    sfile = source.parent.joinpath(f".{source.stem}.summary.json")
+    stat = source.stat()
+    stat = [stat.st_size, stat.st_mtime_ns]
+    stored = io.read_json(sfile)
+    if stored.get("stat") == stat:
+        return sfile, stored
+    return sfile, dict(stat=stat, summaries={})
+
+
+def _write_summary(sfile, stored):
+    if sfile is None:
+        return
+    try:
+        io.write_json(sfile, stored)
+    except OSError:
+        # Read-only data directory, summaries are recalculated next time.
+        pass
+
+
+def _packing_encoding(ds):
+    return {
+        var: dict(
+            dtype="int16",
+            scale_factor=scale,
+            add_offset=0.0,
+            _FillValue=np.iinfo(np.int16).min,
+        )
+        for var, scale in PACKING.items()
+        if var in ds
+    }
+
+
+def _interp_z(ds, znew):
+    """Linearly interpolate all variables with a z dimension to znew.
+
+    Same result as `ds.interp(z=znew)` but profiles are interpolated in
+    groups of identical validity patterns, see `masks.interp_by_mask`.
+    """
+    out = ds.drop_dims("z")
+    out.coords["z"] = ("z", znew, ds.z.attrs)
+    for name, var in ds.variables.items():
+        if "z" not in var.dims or name == "z" or var.dtype.kind not in "iuf":
+            continue
+        out[name] = _apply_along_z(
+            xr.DataArray(var),
+            lambda x: masks.interp_by_mask(x, ds.z, znew),
+            size=znew.size,
+        )
+        if name in ds.coords:
+            out = out.set_coords(name)
+    return out
+
+
+def _apply_along_z(da, fun, size=None):
+    """Apply a function to the (z, profiles) reshaped data of a DataArray."""
+    dims = da.dims
+    other = [dim for dim in dims if dim != "z"]
+    da = da.transpose("z", *other)
+    shape = da.shape[1:]
+    x = np.asarray(da.data)
+    if x.dtype.kind != "f":
+        x = x.astype(float)
+    x = x.reshape(da.shape[0], -1)
+    size = da.shape[0] if size is None else size
+    y = fun(x).reshape((size,) + shape)
+    return xr.DataArray(y, dims=da.dims, attrs=da.attrs).transpose(*dims)
+
+
+def _apply_along_time(ds, tnew, fun):
+    """Resample all variables with a time dimension to tnew.
+
+    fun takes the data with time as last axis, the old and the new time
+    vector as integer nanoseconds and returns the resampled data.
+    """
+    time = ds.time.data.astype("datetime64[ns]").astype(np.int64)
+    tnew = np.asarray(tnew).astype("datetime64[ns]")
+    t = tnew.astype(np.int64)
+    out = ds.drop_dims("time")
+    out.coords["time"] = ("time", tnew, ds.time.attrs)
+    for name, var in ds.variables.items():
+        if "time" not in var.dims or name == "time" or var.dtype.kind not in "iuf":
+            continue
+        dims = var.dims
+        other = [dim for dim in dims if dim != "time"]
+        var = var.transpose(*other, "time")
+        x = var.data if var.dtype.kind == "f" else var.data.astype(float)
+        y = fun(x, time, t)
+        out[name] = xr.Variable(var.dims, y, var.attrs).transpose(*dims)
+        if name in ds.coords:
+            out = out.set_coords(name)
+    return out
+
+
+def _nearest(x, time, tnew):
+    """Nearest sample, NaN outside of the time range."""
+    i = np.clip(np.searchsorted(time, tnew), 1, time.size - 1)
+    i = np.where(tnew - time[i - 1] <= time[i] - tnew, i - 1, i)
+    y = x[..., i]
+    y[..., (tnew < time[0]) | (tnew > time[-1])] = np.nan
+    return y
+
+
+def _bin_average(x, time, tnew):
+    """Mean of all valid samples in bins of the time step centered on tnew."""
+    dt = tnew[1] - tnew[0]
+    edges = np.append(tnew - dt // 2, tnew[-1] + dt - dt // 2)
+    inside = (time >= edges[0]) & (time < edges[-1])
+    x = x[..., inside]
+    bins = np.searchsorted(edges, time[inside], side="right") - 1
+    y = np.full(x.shape[:-1] + (tnew.size,), np.nan, dtype=x.dtype)
+    if bins.size == 0:
+        return y
+    counts = np.bincount(bins, minlength=tnew.size)
+    occupied = np.flatnonzero(counts)
+    # Samples are sorted in time, so each bin is a contiguous block.
+    starts = np.cumsum(counts)[occupied] - counts[occupied]
+    valid = np.isfinite(x)
+    total = np.add.reduceat(np.where(valid, x, 0), starts, axis=-1)
+    n = np.add.reduceat(valid, starts, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        y[..., occupied] = total / n
+    return y
+
+
 def _dropna(ds):
     return ds.dropna(dim="z", how="all")
 
 
 def _p_to_depth(p, lat):
-    z = -gsw.z_from_p(p, lat)
-    z.attrs = dict(long_name="depth", units="m")
-    return z
+    return -gsw.z_from_p(p, lat).astype(p.dtype)
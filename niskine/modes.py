@@ -0,0 +1,154 @@
+"""
+Vertical normal mode decomposition of velocity profiles.
+"""
+
+import numpy as np
+import xarray as xr
+import scipy.linalg
+
+from . import io, masks
+
+
+def vertical_modes(z, n2, nmodes=5, dz=10, cache=True) -> xr.Dataset:
+    """Vertical normal modes for a stratification profile.
+
+    Solves the eigenvalue problem for vertical velocity modes with rigid lid
+    and flat bottom on a regular depth grid from the surface to the deepest
+    stratification value. Horizontal velocity modes are the vertical
+    derivatives of the vertical velocity modes and include the barotropic
+    mode as mode 0. Results are cached under data.cache.
+
+    Parameters
+    ----------
+    z : array-like
+        Depth [m] of the stratification profile, positive down. The
+        deepest value is taken as bottom depth.
+    n2 : array-like
+        Buoyancy frequency squared [1/s^2].
+    nmodes : int, optional
+        Number of baroclinic modes. Defaults to 5.
+    dz : float, optional
+        Vertical resolution [m] for solving the eigenvalue problem. Defaults
+        to 10.
+    cache : bool, optional
+        Read from and write to the cache. Defaults to True.
+
+    Returns
+    -------
+    xr.Dataset
+        Horizontal velocity modes (hmode) and vertical velocity modes
+        (vmode) on (mode, z), and eigenspeeds c [m/s]. Horizontal modes are
+        normalized to a depth-mean square of one.
+    """
+    z = np.asarray(z, dtype=float)
+    n2 = np.asarray(n2, dtype=float)
+    cfile = _cache_file(z, n2, nmodes, dz) if cache else None
+    cached = io.read_cache(cfile)
+    if cached is not None:
+        return cached
+
+    zz = np.arange(0, z.max() + dz / 2, dz)
+    # Interior points for vertical velocity which vanishes at both ends.
+    zi = zz[1:-1]
+    n2i = np.clip(np.interp(zi, z, n2), 1e-10, None)
+    n = zi.size
+    d2 = (
+        np.diag(np.full(n, 2.0))
+        - np.diag(np.ones(n - 1), 1)
+        - np.diag(np.ones(n - 1), -1)
+    ) / dz**2
+    eigenvalues, w = scipy.linalg.eigh(
+        d2, np.diag(n2i), subset_by_index=[0, nmodes - 1]
+    )
+    c = 1 / np.sqrt(eigenvalues)
+    w = np.vstack([np.zeros(nmodes), w, np.zeros(nmodes)])
+    # Horizontal velocity modes on the same grid via centered differences.
+    u = np.gradient(w, dz, axis=0)
+    u = np.hstack([np.ones((zz.size, 1)), u])
+    u = u / np.sqrt(np.mean(u**2, axis=0))
+    # Positive at the surface.
+    sign = np.sign(u[0])
+    u = u * sign
+    w = np.hstack([np.zeros((zz.size, 1)), w * sign[1:]])
+
+    modes = xr.Dataset(
+        dict(
+            hmode=(("mode", "z"), u.T),
+            vmode=(("mode", "z"), w.T),
+            c=(("mode"), np.hstack([np.inf, c])),
+        ),
+        coords=dict(mode=np.arange(nmodes + 1), z=zz),
+    )
+    modes.c.attrs = dict(long_name="eigenspeed", units="m/s")
+    if cfile is not None:
+        io.write_cache(modes, cfile)
+    return modes
+
+
+def fit_modes(data, modes, min_valid=None) -> xr.DataArray:
+    """Least-squares fit of horizontal velocity modes to all profiles.
+
+    Profiles are grouped by their pattern of valid depth levels. The
+    pseudo-inverse of the mode matrix is calculated once per pattern and
+    applied to all profiles sharing it in a single matrix product.
+
+    Parameters
+    ----------
+    data : xr.DataArray
+        Velocity on (z, time), for example u from a merged ADCP dataset.
+    modes : xr.Dataset
+        Modes as returned by `vertical_modes`.
+    min_valid : int, optional
+        Minimum number of valid depth levels for a fit. Defaults to the
+        number of modes. Profiles with fewer valid levels are NaN.
+
+    Returns
+    -------
+    xr.DataArray
+        Mode amplitudes on (mode, time).
+    """
+    hmode = modes.hmode.interp(z=data.z).transpose("z", "mode").data
+    nmodes = hmode.shape[1]
+    min_valid = nmodes if min_valid is None else min_valid
+    x = data.transpose("z", "time").data
+    valid = np.isfinite(x) & np.isfinite(hmode).all(axis=1)[:, np.newaxis]
+
+    amp = np.full((nmodes, x.shape[1]), np.nan)
+    patterns, groups = masks.group_by_mask(valid)
+    for pattern, profiles in zip(patterns, groups):
+        if pattern.sum() < min_valid:
+            continue
+        pinv = np.linalg.pinv(hmode[pattern])
+        amp[:, profiles] = pinv @ x[np.ix_(pattern, profiles)]
+
+    return xr.DataArray(
+        amp,
+        coords=dict(mode=modes.mode, time=data.time),
+        dims=("mode", "time"),
+        attrs=dict(long_name=f"{data.name} mode amplitude"),
+    )
+
+
+def reconstruct(amp, modes, z) -> xr.DataArray:
+    """Velocity profiles from mode amplitudes.
+
+    Parameters
+    ----------
+    amp : xr.DataArray
+        Mode amplitudes as returned by `fit_modes`.
+    modes : xr.Dataset
+        Modes as returned by `vertical_modes`.
+    z : array-like
+        Depth vector.
+
+    Returns
+    -------
+    xr.DataArray
+        Velocity on (z, time).
+    """
+    hmode = modes.hmode.interp(z=z)
+    return xr.dot(hmode, amp, dim="mode").transpose("z", "time")
+
+
+def _cache_file(z, n2, nmodes, dz):
+    return io.cache_file("modes", None, z, n2, nmodes, dz)
@@ -0,0 +1,187 @@
+"""
+Extract gridded fields at mooring locations.
+"""
+
+import functools
+from pathlib import Path
+import numpy as np
+import xarray as xr
+
+from . import io
+
+
+# Bilinear interpolation weights, keyed by grid and location.
+_WEIGHTS = {}
+
+
+def extract_at_moorings(
+    files, moorings=(1, 2, 3), variables=None, lon="lon", lat="lat", cache=True
+) -> xr.Dataset:
+    """Extract time series of gridded fields at mooring locations.
+
+    Each source file is interpolated bilinearly to the mooring locations and
+    the result is cached on disk under data.cache. The cache is keyed by
+    file name, size and modification time, so subsequent calls return the
+    cached time series without reading the gridded data.
+
+    Parameters
+    ----------
+    files : str or pathlib.Path or list
+        Source netcdf file(s), for example data.wind.era5 or the hourly SSH
+        files. Multiple files are concatenated along time.
+    moorings : list of int, optional
+        Mooring numbers. Defaults to all three moorings.
+    variables : list of str, optional
+        Variables to extract. Defaults to all variables that have both
+        horizontal dimensions.
+    lon, lat : str, optional
+        Names of the horizontal coordinates in the source files. Defaults to
+        'lon' and 'lat'. Use 'longitude' and 'latitude' for the Copernicus
+        files.
+    cache : bool, optional
+        Read from and write to the cache. Defaults to True.
+
+    Returns
+    -------
+    xr.Dataset
+        Extracted variables with a mooring dimension.
+    """
+    if isinstance(files, (str, Path)):
+        files = [files]
+    out = [
+        _extract_file(Path(file), list(moorings), variables, lon, lat, cache)
+        for file in files
+    ]
+    return out[0] if len(out) == 1 else xr.concat(out, dim="time")
+
+
+def interpolate_at_moorings(
+    ds, moorings=(1, 2, 3), variables=None, lon="lon", lat="lat"
+) -> xr.Dataset:
+    """Bilinearly interpolate a gridded dataset to mooring locations.
+
+    Only the grid cells surrounding the moorings are read. Grid points with
+    missing data are excluded and the remaining weights renormalized.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Gridded data, may be lazily loaded.
+    moorings : list of int, optional
+        Mooring numbers. Defaults to all three moorings.
+    variables : list of str, optional
+        Variables to interpolate. Defaults to all variables that have both
+        horizontal dimensions.
+    lon, lat : str, optional
+        Names of the horizontal coordinates. Defaults to 'lon' and 'lat'.
+
+    Returns
+    -------
+    xr.Dataset
+        Interpolated variables with a mooring dimension.
+    """
+    moorings = list(moorings)
+    if variables is None:
+        variables = [
+            var for var, da in ds.data_vars.items() if {lon, lat} <= set(da.dims)
+        ]
+    locs = [_mooring_lonlat(mooring) for mooring in moorings]
+    mlon = [loc[0] for loc in locs]
+    mlat = [loc[1] for loc in locs]
+    ilon, ilat, weights = bilinear_weights(ds[lon].data, ds[lat].data, mlon, mlat)
+    index = {
+        lon: xr.DataArray(ilon, dims=("mooring", "cx")),
+        lat: xr.DataArray(ilat, dims=("mooring", "cy")),
+    }
+    weights = xr.DataArray(weights, dims=("mooring", "cy", "cx"))
+    corners = ds[variables].isel(index).load()
+    corners = corners.drop_vars([lon, lat], errors="ignore")
+    valid = corners.notnull()
+    out = (corners.fillna(0) * weights).sum(dim=("cy", "cx")) / (
+        valid * weights
+    ).sum(dim=("cy", "cx"))
+    out = out.transpose("mooring", ...)
+    for var in variables:
+        out[var].attrs = ds[var].attrs
+    out.coords["mooring"] = moorings
+    out.coords["lon"] = ("mooring", mlon)
+    out.coords["lat"] = ("mooring", mlat)
+    return out
+
+
+def bilinear_weights(lon_grid, lat_grid, lon, lat):
+    """Bilinear interpolation weights on a regular grid.
+
+    Weights are computed once per grid and location and kept in memory.
+
+    Parameters
+    ----------
+    lon_grid, lat_grid : array-like
+        Monotonic grid coordinates (ascending or descending).
+    lon, lat : array-like
+        Locations.
+
+    Returns
+    -------
+    ilon : np.ndarray
+        Indices of the bracketing longitudes, shape (n, 2).
+    ilat : np.ndarray
+        Indices of the bracketing latitudes, shape (n, 2).
+    weights : np.ndarray
+        Weights, shape (n, 2, 2) ordered (point, lat, lon).
+    """
+    lon_grid = np.asarray(lon_grid)
+    lat_grid = np.asarray(lat_grid)
+    key = (
+        _grid_signature(lon_grid, lat_grid),
+        tuple(np.atleast_1d(lon)),
+        tuple(np.atleast_1d(lat)),
+    )
+    if key not in _WEIGHTS:
+        ilon, wlon = _bracket(lon_grid, np.atleast_1d(lon))
+        ilat, wlat = _bracket(lat_grid, np.atleast_1d(lat))
+        weights = wlat[:, :, np.newaxis] * wlon[:, np.newaxis, :]
+        _WEIGHTS[key] = ilon, ilat, weights
+    return _WEIGHTS[key]
+
+
+def cache_file(file, moorings, variables, lon="lon", lat="lat"):
+    """Path to the cached point extraction for a source file."""
+    return io.cache_file("points", file, moorings, variables, lon, lat)
+
+
+def _extract_file(file, moorings, variables, lon, lat, cache):
+    cfile = cache_file(file, moorings, variables, lon, lat)
+    cached = io.read_cache(cfile) if cache else None
+    if cached is not None:
+        return cached
+    with xr.open_dataset(file) as ds:
+        out = interpolate_at_moorings(ds, moorings, variables, lon, lat)
+    if cache:
+        out.attrs["source"] = Path(file).resolve().as_posix()
+        io.write_cache(out, cfile)
+    return out
+
+
+def _bracket(coord, x):
+    n = coord.size
+    ascending = coord[-1] > coord[0]
+    c = coord if ascending else coord[::-1]
+    i = np.clip(np.searchsorted(c, x) - 1, 0, n - 2)
+    frac = (x - c[i]) / (c[i + 1] - c[i])
+    if np.any((frac < 0) | (frac > 1)):
+        raise ValueError("location outside of grid")
+    index = np.stack([i, i + 1], axis=-1)
+    if not ascending:
+        index = n - 1 - index
+    return index, np.stack([1 - frac, frac], axis=-1)
+
+
+def _grid_signature(lon_grid, lat_grid):
+    return io.fingerprint(lon_grid, lat_grid)
+
+
+@functools.lru_cache
+def _mooring_lonlat(mooring):
+    lon, lat, _ = io.mooring_location(mooring)
+    return lon, lat
@@ -0,0 +1,328 @@
+"""
+Rotary spectra of mooring velocity.
+"""
+
+import concurrent.futures
+import os
+import numpy as np
+import xarray as xr
+import scipy.fft
+import scipy.signal
+
+from . import filters
+
+
+def rotary_spectra(
+    data,
+    nperseg=2048,
+    overlap=0.5,
+    window="hann",
+    batch=64,
+    workers=-1,
+) -> xr.Dataset:
+    """Welch-averaged rotary spectra for all depth levels.
+
+    Clockwise and counter-clockwise spectral densities of w = u + iv are
+    calculated for every depth level in one batched FFT. Segments containing
+    missing data are excluded from the average of the respective depth
+    level, so gaps do not contaminate the spectra.
+
+    Parameters
+    ----------
+    data : xr.Dataset
+        Regularly sampled u and v, for example a merged ADCP dataset.
+    nperseg : int, optional
+        Segment length. Defaults to 2048 (about 14 days of 10 minute data).
+    overlap : float, optional
+        Segment overlap fraction. Defaults to 0.5.
+    window : str, optional
+        Window applied to each segment. Defaults to 'hann'.
+    batch : int, optional
+        Number of segments transformed at once. Defaults to 64.
+    workers : int, optional
+        Number of cores used for the FFTs. Defaults to all cores.
+
+    Returns
+    -------
+    xr.Dataset
+        Clockwise (cw) and counter-clockwise (ccw) power spectral density
+        [(m/s)^2/Hz] and number of segments averaged (nseg).
+    """
+    w = data.u + 1j * data.v
+    other = [dim for dim in w.dims if dim != "time"]
+    w = w.transpose(*other, "time")
+    dt = filters.dt_seconds(data.time)
+
+    segments = Segments(w.data, nperseg, overlap, window)
+    acc = np.zeros(w.shape[:-1] + (nperseg,))
+    for valid, fw in segments.ffts(batch, workers):
+        acc += np.einsum("...s,...sf->...f", valid, np.abs(fw) ** 2)
+    nseg = segments.valid.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        psd = acc / nseg[..., np.newaxis] * dt / (segments.window**2).sum()
+
+    freq = scipy.fft.fftfreq(nperseg, dt)
+    pos = np.arange(1, nperseg // 2 + 1)
+    neg = (nperseg - pos) % nperseg
+    coords = {dim: w[dim] for dim in other if dim in w.coords}
+    coords["frequency"] = freq[pos]
+    dims = tuple(other) + ("frequency",)
+    out = xr.Dataset(coords=coords)
+    out["ccw"] = (dims, psd[..., pos])
+    out["cw"] = (dims, psd[..., neg])
+    out["nseg"] = (tuple(other), nseg)
+    out.frequency.attrs = dict(long_name="frequency", units="Hz")
+    for var in ["cw", "ccw"]:
+        out[var].attrs = dict(units="(m/s)$^2$/Hz")
+    return out
+
+
+class Segments:
+
+    """Overlapping, windowed segments of a regularly sampled record."""
+
+    def __init__(self, x, nperseg, overlap=0.5, window="hann"):
+        """Segment a record along its last axis.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            Data, segmented along the last axis. May be complex.
+        nperseg : int
+            Segment length.
+        overlap : float, optional
+            Segment overlap fraction. Defaults to 0.5.
+        window : str, optional
+            Window applied to each segment. Defaults to 'hann'.
+        """
+        self.x = x
+        self.nperseg = nperseg
+        step = max(1, int(nperseg * (1 - overlap)))
+        self.starts = np.arange(0, x.shape[-1] - nperseg + 1, step)
+        self.window = scipy.signal.get_window(window, nperseg)
+        # Segments without missing data, from the cumulative count of NaNs.
+        nans = np.cumsum(np.isnan(x), axis=-1)
+        nans = np.concatenate([np.zeros(x.shape[:-1] + (1,)), nans], axis=-1)
+        self.valid = (
+            nans[..., self.starts + nperseg] - nans[..., self.starts]
+        ) == 0
+
+    def ffts(self, batch=64, workers=-1):
+        """Fourier transforms of detrended, windowed segments.
+
+        Yields
+        ------
+        valid : np.ndarray
+            Segment validity, shape (..., segments in batch).
+        fx : np.ndarray
+            Segment transforms, shape (..., segments in batch, nperseg).
+            Zero for invalid segments.
+        """
+        index = np.arange(self.nperseg)
+        for i in range(0, self.starts.size, batch):
+            starts = self.starts[i : i + batch]
+            valid = self.valid[..., i : i + batch]
+            seg = self.x[..., starts[:, np.newaxis] + index]
+            seg = np.where(valid[..., np.newaxis], seg, 0)
+            seg = seg - seg.mean(axis=-1, keepdims=True)
+            fx = scipy.fft.fft(seg * self.window, axis=-1, workers=workers)
+            yield valid, fx
+
+
+class CrossSpectra:
+
+    """Cross-spectra, coherence and lagged correlation between series."""
+
+    def __init__(
+        self,
+        data,
+        dim,
+        nperseg=2048,
+        overlap=0.5,
+        window="hann",
+        batch=64,
+        workers=-1,
+    ):
+        """Welch-averaged cross-spectral analysis along one dimension.
+
+        Pairs are formed between the elements of `dim`, for example depth
+        levels (z) or moorings of the array product. Segment transforms of
+        each element are computed once, when first needed, and cached so
+        that further pairs reuse them. Only segments without missing data in
+        both series of a pair enter its averages.
+
+        Parameters
+        ----------
+        data : xr.DataArray
+            Regularly sampled data on `dim` and time, possibly with further
+            dimensions. May be complex, e.g. u + iv for rotary analysis.
+        dim : str
+            Dimension along which pairs are formed.
+        nperseg : int, optional
+            Segment length. Defaults to 2048.
+        overlap : float, optional
+            Segment overlap fraction. Defaults to 0.5.
+        window : str, optional
+            Window applied to each segment. Defaults to 'hann'.
+        batch : int, optional
+            Number of segments transformed at once. Defaults to 64.
+        workers : int, optional
+            Number of threads for FFTs and pairs. Defaults to all cores.
+        """
+        self.data = data.transpose(dim, ..., "time")
+        self.dim = dim
+        self.nperseg = nperseg
+        self.overlap = overlap
+        self.window = window
+        self.batch = batch
+        self.workers = os.cpu_count() if workers == -1 else workers
+        self.dt = filters.dt_seconds(data.time)
+        self.complex = np.iscomplexobj(self.data.data)
+        self._valid = {}
+        self._fft = {}
+
+    def cross_spectra(self, pairs=None) -> xr.Dataset:
+        """Cross-spectral density, coherence and phase for pairs.
+
+        Parameters
+        ----------
+        pairs : list of tuple, optional
+            Pairs (i, j) of integer positions along `dim`. Defaults to all
+            pairs with i < j.
+
+        Returns
+        -------
+        xr.Dataset
+            Cross-spectral density (csd), squared coherence (coherence),
+            phase [rad] (phase) and number of segments (nseg) on (pair, ...,
+            frequency). The csd is the average of Xi conj(Xj) over segments,
+            the complex conjugate of `scipy.signal.csd(xi, xj)`, such that
+            positive phase means series i leads series j. For real data it
+            is one-sided like scipy's, with the power of negative
+            frequencies added to the positive ones; for complex data it is
+            two-sided.
+        """
+        i, j = self._pairs(pairs)
+        self._compute(np.union1d(i, j))
+        spectra = self._map_pairs(self._pair_spectra, i, j)
+        sij, sii, sjj, nseg = [np.concatenate(s) for s in zip(*spectra)]
+        freq = scipy.fft.fftfreq(self.nperseg, self.dt)
+        keep = self._frequencies(freq)
+        freq = freq[keep] if self.complex else np.abs(freq[keep])
+        scale = self.dt / (self._window**2).sum()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            csd = sij / nseg[..., np.newaxis] * scale
+            coherence = np.abs(sij) ** 2 / (sii * sjj)
+        if not self.complex:
+            # One-sided: double all but the zero and Nyquist frequencies.
+            csd[..., 1 : (self.nperseg + 1) // 2] *= 2
+
+        out = self._dataset(i, j)
+        dims = ("pair",) + self.data.dims[1:-1]
+        out.coords["frequency"] = freq
+        out.frequency.attrs = dict(long_name="frequency", units="Hz")
+        out["csd"] = (dims + ("frequency",), csd[..., keep])
+        out["coherence"] = (dims + ("frequency",), coherence[..., keep])
+        out["phase"] = (dims + ("frequency",), np.angle(sij[..., keep]))
+        out["phase"].attrs = dict(long_name="phase", units="rad")
+        out["nseg"] = (dims, nseg)
+        return out
+
+    def lagged_correlation(self, pairs=None, maxlag=None) -> xr.Dataset:
+        """Lagged correlation for pairs from the averaged cross-spectra.
+
+        The correlation is circular within segments, use lags well below the
+        segment length.
+
+        Parameters
+        ----------
+        pairs : list of tuple, optional
+            Pairs (i, j) of integer positions along `dim`. Defaults to all
+            pairs with i < j.
+        maxlag : int, optional
+            Maximum lag in time steps. Defaults to half the segment length.
+
+        Returns
+        -------
+        xr.Dataset
+            Correlation (corr) on (pair, ..., lag). Positive lags mean
+            series j lags series i. Magnitude for complex data.
+        """
+        maxlag = self.nperseg // 2 if maxlag is None else maxlag
+        i, j = self._pairs(pairs)
+        self._compute(np.union1d(i, j))
+        spectra = self._map_pairs(self._pair_spectra, i, j)
+        sij, sii, sjj, _ = [np.concatenate(s) for s in zip(*spectra)]
+        rij = scipy.fft.ifft(np.conj(sij), axis=-1, workers=self.workers)
+        rii = sii.sum(axis=-1) / self.nperseg
+        rjj = sjj.sum(axis=-1) / self.nperseg
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = rij / np.sqrt(rii * rjj)[..., np.newaxis]
+        lags = np.arange(-maxlag, maxlag + 1)
+        corr = corr[..., lags % self.nperseg]
+        corr = np.abs(corr) if self.complex else corr.real
+
+        out = self._dataset(i, j)
+        out.coords["lag"] = lags * self.dt
+        out.lag.attrs = dict(long_name="lag", units="s")
+        out["corr"] = (("pair",) + self.data.dims[1:-1] + ("lag",), corr)
+        return out
+
+    def _compute(self, indices):
+        """Segment transforms for elements that are not cached yet."""
+        missing = [k for k in indices if k not in self._fft]
+        if not missing:
+            return
+        x = np.asarray(self.data.isel({self.dim: missing}).data)
+        segments = Segments(x, self.nperseg, self.overlap, self.window)
+        self._window = segments.window
+        valid, fx = zip(*segments.ffts(self.batch, self.workers))
+        valid = np.concatenate(valid, axis=-1)
+        fx = np.concatenate(fx, axis=-2)
+        for n, k in enumerate(missing):
+            self._valid[k] = valid[n]
+            self._fft[k] = fx[n]
+
+    def _pair_spectra(self, i, j):
+        """Sums over jointly valid segments for a batch of pairs."""
+        valid = np.stack([self._valid[a] & self._valid[b] for a, b in zip(i, j)])
+        fi = np.stack([self._fft[a] for a in i])
+        fj = np.stack([self._fft[b] for b in j])
+        v = valid[..., np.newaxis]
+        sij = (v * fi * np.conj(fj)).sum(axis=-2)
+        sii = (v * np.abs(fi) ** 2).sum(axis=-2)
+        sjj = (v * np.abs(fj) ** 2).sum(axis=-2)
+        return sij, sii, sjj, valid.sum(axis=-1)
+
+    def _map_pairs(self, fun, i, j):
+        """Apply a function to batches of pairs in parallel threads."""
+        size = max(1, -(-i.size // self.workers))
+        batches = [
+            (i[k : k + size], j[k : k + size]) for k in range(0, i.size, size)
+        ]
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(lambda b: fun(*b), batches))
+
+    def _pairs(self, pairs):
+        if pairs is None:
+            i, j = np.triu_indices(self.data.shape[0], 1)
+        else:
+            i, j = np.asarray(pairs, dtype=int).reshape(-1, 2).T
+        return i, j
+
+    def _frequencies(self, freq):
+        """Sorted frequencies, non-negative ones only for real data."""
+        if self.complex:
+            return np.argsort(freq)
+        return np.arange(self.nperseg // 2 + 1)
+
+    def _dataset(self, i, j):
+        coords = {
+            dim: self.data[dim]
+            for dim in self.data.dims[1:-1]
+            if dim in self.data.coords
+        }
+        values = self.data[self.dim].data
+        coords[f"{self.dim}_i"] = ("pair", values[i])
+        coords[f"{self.dim}_j"] = ("pair", values[j])
+        return xr.Dataset(coords=coords)
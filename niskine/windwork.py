@@ -0,0 +1,215 @@
+"""
+Wind work on near-inertial mixed layer currents.
+"""
+
+import numpy as np
+import xarray as xr
+
+from . import filters, io, points
+
+
+class WindWork:
+
+    """Near-inertial wind work at a mooring."""
+
+    def __init__(
+        self,
+        mooring: int,
+        mld: float = 50,
+        band=(0.8, 1.2),
+        wind=None,
+        adcp=None,
+        block_days: int = 30,
+    ):
+        """Calculate wind power input into near-inertial mixed layer currents.
+
+        ERA5 10m wind is interpolated to the mooring location and converted
+        to wind stress using a bulk formula. Wind stress and mixed layer
+        velocity are band-passed around the local inertial frequency and
+        their product, the near-inertial wind work, is integrated over the
+        deployment.
+
+        Parameters
+        ----------
+        mooring : int
+            Mooring number.
+        mld : float, optional
+            Mixed layer depth [m]. Velocities are averaged over depth levels
+            shallower than this. Defaults to 50m.
+        band : tuple, optional
+            Pass band in multiples of the local inertial frequency. Defaults
+            to (0.8, 1.2).
+        wind : xr.Dataset, optional
+            ERA5 wind at the mooring location as returned by
+            `era5_at_moorings`. Read from data.wind.era5 if not provided.
+        adcp : xr.Dataset, optional
+            Gridded ADCP data. Read via `io.load_gridded_adcp` if not
+            provided.
+        block_days : int, optional
+            Length of time blocks [days] for integrating wind work. Defaults
+            to 30.
+        """
+        self.mooring = mooring
+        self.mld = mld
+        self.band = band
+        self.block_days = block_days
+
+        if adcp is None:
+            adcp = io.load_gridded_adcp(mooring)
+        if wind is None:
+            wind = era5_at_moorings(moorings=[mooring]).sel(mooring=mooring)
+        self.lat = adcp.attrs["lat"]
+
+        self.uml = mixed_layer_velocity(adcp, self.mld)
+        self.time = self.uml.time
+
+        print("calculating wind stress...")
+        wind = wind.interp(time=self.time)
+        self.taux, self.tauy = wind_stress(wind.u10, wind.v10)
+
+        print("band-passing...")
+        forcing = xr.Dataset(
+            dict(u=self.uml.u, v=self.uml.v, taux=self.taux, tauy=self.tauy)
+        )
+        # Gaps are interpolated so that the filter does not ring around
+        # them, and masked again afterwards.
+        self.ni = filters.bandpass_inertial(
+            forcing.interpolate_na(dim="time"), lat=self.lat, band=self.band
+        ).where(forcing.notnull())
+
+        print("integrating wind work...")
+        self.power = wind_power(
+            self.ni.taux, self.ni.tauy, self.ni.u, self.ni.v
+        )
+        self.work = integrate_power(self.power, self.block_days)
+
+
+def era5_at_moorings(moorings=(1, 2, 3), era5=None) -> xr.Dataset:
+    """Interpolate ERA5 wind to mooring locations.
+
+    All mooring locations are interpolated at once and only the grid cells
+    surrounding the moorings are read. When reading from data.wind.era5 the
+    extracted time series are cached, see `points.extract_at_moorings`.
+
+    Parameters
+    ----------
+    moorings : list of int, optional
+        Mooring numbers. Defaults to all three moorings.
+    era5 : xr.Dataset, optional
+        ERA5 wind. Defaults to reading data.wind.era5.
+
+    Returns
+    -------
+    wind : xr.Dataset
+        u10 and v10 with dimensions (mooring, time).
+    """
+    variables = ["u10", "v10"]
+    if era5 is None:
+        conf = io.load_config()
+        return points.extract_at_moorings(conf.data.wind.era5, moorings, variables)
+    return points.interpolate_at_moorings(era5, moorings, variables)
+
+
+def wind_stress(u10, v10, rho_air=1.22):
+    """Wind stress from 10m wind using the Large & Pond (1981) drag coefficient.
+
+    Parameters
+    ----------
+    u10, v10 : array-like
+        10m wind components [m/s].
+    rho_air : float, optional
+        Air density [kg/m^3]. Defaults to 1.22.
+
+    Returns
+    -------
+    taux, tauy : array-like
+        Wind stress components [N/m^2].
+    """
+    speed = np.sqrt(u10**2 + v10**2)
+    cd = drag_coefficient(speed)
+    taux = rho_air * cd * speed * u10
+    tauy = rho_air * cd * speed * v10
+    if isinstance(taux, xr.DataArray):
+        taux.attrs = dict(long_name=r"$\tau_x$", units="N/m$^2$")
+        tauy.attrs = dict(long_name=r"$\tau_y$", units="N/m$^2$")
+    return taux, tauy
+
+
+def drag_coefficient(speed):
+    """Large & Pond (1981) neutral drag coefficient.
+
+    Constant below 11 m/s and capped at 25 m/s.
+
+    Parameters
+    ----------
+    speed : array-like
+        10m wind speed [m/s].
+
+    Returns
+    -------
+    cd : array-like
+        Drag coefficient.
+    """
+    s = np.clip(speed, 11, 25)
+    return np.where(speed < 11, 1.2e-3, (0.49 + 0.065 * s) * 1e-3)
+
+
+def mixed_layer_velocity(adcp, mld):
+    """Average velocity over the mixed layer.
+
+    Falls back to the shallowest depth level with data if no depth level is
+    shallower than the mixed layer depth.
+
+    Parameters
+    ----------
+    adcp : xr.Dataset
+        Gridded ADCP data with u and v on (z, time).
+    mld : float
+        Mixed layer depth [m].
+
+    Returns
+    -------
+    uml : xr.Dataset
+        Mixed layer velocity.
+    """
+    uv = adcp[["u", "v"]]
+    uv = uv.isel(z=uv.u.notnull().any(dim="time"))
+    ml = uv.where(uv.z <= mld, drop=True)
+    if ml.z.size == 0:
+        ml = uv.isel(z=[0])
+    return ml.mean(dim="z").load()
+
+
+def wind_power(taux, tauy, u, v):
+    """Wind power input [W/m^2]."""
+    power = taux * u + tauy * v
+    power.attrs = dict(long_name="wind work", units="W/m$^2$")
+    return power
+
+
+def integrate_power(power, block_days=30):
+    """Integrate wind power over time, one block at a time.
+
+    Parameters
+    ----------
+    power : xr.DataArray
+        Wind power input [W/m^2].
+    block_days : int, optional
+        Block length [days]. Defaults to 30.
+
+    Returns
+    -------
+    work : xr.DataArray
+        Cumulative wind work [J/m^2].
+    """
+    dt = filters.dt_seconds(power.time)
+    n = int(block_days * 86400 / dt)
+    work = np.empty(power.time.size)
+    carry = 0.0
+    for i in range(0, power.time.size, n):
+        block = np.nan_to_num(power.isel(time=slice(i, i + n)).data) * dt
+        work[i : i + n] = carry + np.cumsum(block)
+        carry = work[min(i + n, power.time.size) - 1]
+    work = xr.DataArray(work, coords=dict(time=power.time))
+    work.attrs = dict(long_name="cumulative wind work", units="J/m$^2$")
+    return work
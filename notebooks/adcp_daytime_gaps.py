@@ -77,3 +77,14 @@ a.sel(time=t2).amp.dropna(dim='z', how='all').gv.tplot()
 
 # %%
 a.sel(time=t2).pg.dropna(dim='z', how='all').gv.tplot()
+
+# %% [markdown]
+# `niskine.coverage` summarizes the range loss for the whole record. Compare day and night coverage month by month.
+
+# %%
+lon, lat, _ = niskine.io.mooring_location(mooring=1)
+ci = niskine.coverage.coverage_index(a, lon, lat)
+summary = niskine.coverage.day_night_summary(ci)
+
+# %%
+summary.range.plot(hue='period', marker='o');
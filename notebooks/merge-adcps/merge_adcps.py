@@ -74,7 +74,7 @@ ma = niskine.merge.MergeADCP(mooring=1, method='simple')
 overlap = niskine.merge.determine_overlap(ma.adcps_sorted_ti_zi)
 
 # %% hidden=true
-overlap.sum(dim='adcp').plot()
+overlap.nadcp.plot()
 
 # %% hidden=true
 ma.merged.u.gv.tcoarsen().gv.tplot(vmin=-0.7, vmax=0.7)
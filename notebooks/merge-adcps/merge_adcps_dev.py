@@ -186,13 +186,13 @@ for ci in asort_ti_zi:
 overlap = niskine.merge.determine_overlap(asort_ti_zi)
 
 # %% hidden=true
-overlap.sum(dim='adcp').plot()
+overlap.nadcp.plot()
 
 # %% hidden=true
-overlap.sum(dim='adcp').max(dim='z').plot()
+overlap.nadcp.max(dim='z').plot()
 
 # %% hidden=true
-h, bins, hh = overlap.sum(dim='adcp').max(dim='z').plot.hist(bins=[0, 1, 2, 3])
+h, bins, hh = overlap.nadcp.max(dim='z').plot.hist(bins=[0, 1, 2, 3])
 
 # %% hidden=true
 print(f'overlaps {int(h[2])} times')
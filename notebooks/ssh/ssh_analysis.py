@@ -93,6 +93,12 @@ mb
 mbc = mb.coarsen({'lon': 10, 'lat': 10}, boundary='pad')
 b = mbc.mean()
 
+# %% [markdown]
+# Faster: read a coarse level from the precomputed multibeam pyramid. Generate the pyramid once via `niskine.bathy.build_mb_pyramid()`.
+
+# %%
+b = niskine.bathy.load_mb(resolution=0.05)
+
 # %%
 b.plot()
 
@@ -125,6 +131,13 @@ ss.plot.contour(levels=np.arange(-3000, 500, 500), colors='w', linestyles='-', l
 # %%
 eke_climatology = alt.eke.groupby('time.month').mean('time')
 
+# %% [markdown]
+# `niskine.eke.eke_statistics` computes the same climatology together with the time mean and standard deviation in one pass over the record without loading it into memory. The result is cached.
+
+# %%
+eke_stats = niskine.eke.eke_statistics()
+eke_climatology = eke_stats.eke_climatology
+
 
 # %%
 def gl_format(ax):
@@ -179,4 +192,16 @@ explained = solver.varianceFraction()
 # %%
 explained[:10].plot(marker='o')
 
+# %% [markdown]
+# `niskine.eof.Eof` finds the leading modes with a randomized SVD, reading the data in blocks of time. This is much faster and uses much less memory than the full SVD above.
+
+# %%
+fast_solver = niskine.eof.Eof(alt.eke, neofs=4)
+
+# %%
+fast_solver.eofs_as_covariance().plot(col='mode')
+
+# %%
+fast_solver.variance_fraction().plot(marker='o')
+
 # %%
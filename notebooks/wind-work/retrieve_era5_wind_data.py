@@ -51,6 +51,22 @@ conf = niskine.io.load_config()
 # %% [markdown]
 # Go here to generate your api request: https://cds.climate.copernicus.eu/cdsapp#!/dataset/reanalysis-era5-pressure-levels?tab=form
 
+# %% [markdown]
+# `niskine.era5.RetrieveERA5` splits the retrieval into monthly requests that run concurrently, converts each month to netcdf as it arrives and keeps track of finished months in a manifest file under `data.wind.monthly`. Run `retrieve()` again to pick up months that failed. `assemble()` writes the combined file to `data.wind.era5`.
+
+# %%
+R = niskine.era5.RetrieveERA5(years=[2018, 2019, 2020])
+
+# %%
+failed = R.retrieve()
+failed
+
+# %%
+R.assemble()
+
+# %% [markdown]
+# Below is the original single request for all three years.
+
 # %% [markdown]
 # Data are saved to a `.grib` file that can be read with `xarray`.
 
@@ -32,4 +32,7 @@ setup(
     include_package_data=True,
     packages=find_packages(include=['niskine', 'niskine.*'], exclude=["*.tests"]),
     zip_safe=False,
+    entry_points={
+        "console_scripts": ["niskine=niskine.cli:main"],
+    },
 )
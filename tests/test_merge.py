@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from niskine import masks, merge
+
+
+def gappy_adcp(scattered, seed=0):
+    """Synthetic ADCP data on an irregular depth grid with missing data."""
+    rng = np.random.default_rng(seed)
+    z = np.sort(rng.uniform(50, 500, 30))
+    time = np.arange("2019-05-01", "2019-05-05", 10, dtype="datetime64[m]")
+    ds = xr.Dataset(coords=dict(z=z, time=time.astype("datetime64[ns]")))
+    for var in ["u", "v"]:
+        x = rng.standard_normal((z.size, time.size))
+        if scattered:
+            x[rng.random(x.shape) < 0.2] = np.nan
+        else:
+            x[rng.random(z.size) < 0.2] = np.nan
+            x[:, rng.random(time.size) < 0.1] = np.nan
+            x[:3, : time.size // 2] = np.nan
+        ds[var] = (("z", "time"), x)
+    return ds
+
+
+@pytest.mark.parametrize("scattered", [True, False])
+def test_interp_z(scattered):
+    ds = gappy_adcp(scattered)
+    znew = np.arange(40, 520, 16.0)
+    expected = ds.interp(z=znew)
+    result = merge._interp_z(ds, znew)
+    for var in ["u", "v"]:
+        np.testing.assert_allclose(
+            result[var].transpose("z", "time").data,
+            expected[var].transpose("z", "time").data,
+            rtol=1e-12,
+            atol=1e-12,
+        )
+
+
+@pytest.mark.parametrize("scattered", [True, False])
+def test_fill_gaps(scattered):
+    ds = gappy_adcp(scattered)
+    expected = ds.interpolate_na(dim="z")
+    result = merge.fill_gaps(ds.copy())
+    for var in ["u", "v"]:
+        np.testing.assert_allclose(
+            result[var].transpose("z", "time").data,
+            expected[var].transpose("z", "time").data,
+            rtol=1e-12,
+            atol=1e-12,
+        )
+
+
+@pytest.mark.parametrize("fill", [False, True])
+def test_interp_by_mask_paths_agree(fill, monkeypatch):
+    ds = gappy_adcp(scattered=True)
+    x = ds.u.data
+    znew = np.concatenate([ds.z.data[::3], np.arange(40, 520, 16.0)])
+    per_profile = masks.interp_by_mask(x, ds.z.data, znew, fill=fill)
+    monkeypatch.setattr(masks, "_MAX_GROUP_FRACTION", np.inf)
+    grouped = masks.interp_by_mask(x, ds.z.data, znew, fill=fill)
+    np.testing.assert_allclose(per_profile, grouped, rtol=1e-12, atol=1e-12)